@@ -45,6 +45,8 @@ class Campaign:
             self.campaign_name = name
 
         self.accum_data = {}
+        # the registry of named surrogates, see add_surrogate
+        self.surrogates = {}
 
     def load_hdf5_data(self, **kwargs):
         """
@@ -53,11 +55,14 @@ class Campaign:
         Parameters
         ----------
         **kwargs : if this contains file_path=<path_to_file>, load this file
-        directly, otherwise open up a filedialog window
+        directly, otherwise open up a filedialog window. If this contains
+        in_memory=False, the data is not read, and the h5py datasets are returned
+        instead, e.g. for out-of-core training with ANN_Surrogate.train(chunk_size=...).
 
         Returns
         -------
-        None.
+        data_frame : dict
+            The data, with the HDF5 keys as keys.
 
         """
 
@@ -78,6 +83,13 @@ class Campaign:
         h5f = h5py.File(file_path, 'r')
         data_frame = {}
 
+        # keep the data on disk, the file remains open
+        if not kwargs.get('in_memory', True):
+            for key in h5f.keys():
+                print('Opened %s' % key)
+                data_frame[key] = h5f[key]
+            return data_frame
+
         # convert HDF5 data to a dictionary
         for key in h5f.keys():
             print('Loaded %s' % key)
@@ -252,6 +264,104 @@ class Campaign:
         self.campaign_name = name
         self.surrogate = surrogate
 
+    def add_surrogate(self, name, surrogate, share_features_with=None):
+        """
+        Add a named surrogate to the registry of the campaign. Several surrogates, e.g.
+        an ANN for u and a QSN for v that are conditioned on the same time-lagged
+        features, can share a single Feature_Engineering object. The feature history,
+        time lags and local neighbourhoods are then processed once per time step in the
+        predict subroutine of the campaign, and the features are passed to every
+        surrogate that shares them.
+
+        Parameters
+        ----------
+        name : string
+            The name of the surrogate.
+        surrogate : object
+            A surrogate object.
+        share_features_with : string, optional
+            The name of a registered surrogate, of which the Feature_Engineering object
+            is also used by this surrogate. The surrogates must be trained with the same
+            features, time lags and local flag. Only surrogates with a batched
+            _feed_forward subroutine (ANN, QSN and KMN surrogates) without an input
+            projection can share features. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        if not hasattr(self, 'surrogates'):
+            self.surrogates = {}
+
+        if share_features_with is not None:
+            # imported here, the surrogate classes depend on this module
+            from .methods import ANN_Surrogate, QSN_Surrogate, KMN_Surrogate
+
+            assert share_features_with in self.surrogates, \
+                "Unknown surrogate '%s'" % share_features_with
+            other = self.surrogates[share_features_with]
+            for surr in [surrogate, other]:
+                assert isinstance(surr, (ANN_Surrogate, QSN_Surrogate, KMN_Surrogate)) and \
+                    getattr(surr, 'projection', None) is None, \
+                    "%s cannot share features" % type(surr).__name__
+            # surrogates that are already trained must be conditioned on the same features
+            if hasattr(surrogate, 'lags') and hasattr(other, 'lags'):
+                assert surrogate.lags == other.lags and surrogate.local == other.local, \
+                    "Surrogates that share features must use the same lags and local flag"
+            surrogate.feat_eng = other.feat_eng
+
+        self.surrogates[name] = surrogate
+
+    def predict(self, X, names=None):
+        """
+        Evaluate the registered surrogates. Surrogates that share a Feature_Engineering
+        object are evaluated on features that are processed once, such that the
+        current state X is appended to their common feature history only once.
+
+        Parameters
+        ----------
+        X : array or list of arrays
+            The feature array or list of feature arrays at the current (time) step.
+        names : list of strings, optional
+            The names of the surrogates to evaluate. The default is None, meaning all
+            registered surrogates.
+
+        Returns
+        -------
+        dict
+            The prediction of every surrogate, by name.
+
+        """
+        if names is None:
+            names = list(self.surrogates.keys())
+
+        # group the surrogates by their Feature_Engineering object, surrogates without
+        # one form a group of their own
+        groups = {}
+        for name in names:
+            feat_eng = getattr(self.surrogates[name], 'feat_eng', None)
+            key = id(feat_eng) if feat_eng is not None else name
+            groups.setdefault(key, []).append(name)
+
+        predictions = {}
+        for group in groups.values():
+            # surrogates with their own features use their own predict subroutine
+            if len(group) == 1:
+                predictions[group[0]] = self.surrogates[group[0]].predict(X)
+                continue
+
+            surrogates = [self.surrogates[name] for name in group]
+            assert all([surr.lags == surrogates[0].lags for surr in surrogates]), \
+                "Surrogates that share features must use the same lags"
+            feat_eng = surrogates[0].feat_eng
+            feats, local = feat_eng._predict_features(X)
+            for name, surr in zip(group, surrogates):
+                predictions[name] = feat_eng._feed_forward_features(
+                    feats, local, surr._feed_forward, vectorized=True)
+
+        return predictions
+
     def load_state(self, **kwargs):
         """
         Loads the state of the current campaign from a pickle file
@@ -0,0 +1,276 @@
+"""
+Class for an out-of-core data set, read from disk in chunks.
+"""
+
+import h5py
+import numpy as np
+
+from .RunningMoments import RunningMoments
+
+
+class ChunkedDataset:
+    """
+    Training data set that is backed by on-disk arrays, e.g. HDF5 datasets opened with
+    h5py. The samples are read in chunks of consecutive samples, and only the most
+    recently read chunk is kept in memory. Mini batches are drawn from the chunk in
+    memory (see sample), and the chunk is replaced by a randomly selected chunk after
+    a number of mini batches.
+
+    Every row contains the concatenated arrays of a single sample. In the case of a
+    local surrogate, every sample gives n_points rows of scalar features (one per
+    grid point), ordered by grid point within every chunk.
+    """
+
+    def __init__(self, arrays, start=0, stop=None, chunk_size=10**4, local=False,
+                 batches_per_chunk=None):
+        """
+        Create a ChunkedDataset object.
+
+        Parameters
+        ----------
+        arrays : list of array-like objects
+            The on-disk arrays, each of shape (n_samples, n_points_i). Only slicing along
+            the first dimension is used, such that h5py datasets or numpy memmaps can be
+            used.
+        start : int, optional
+            The first sample of the data set. The default is 0.
+        stop : int, optional
+            The end (exclusive) of the samples of the data set. The default is None,
+            meaning all samples from start onwards.
+        chunk_size : int, optional
+            The number of samples per chunk. The default is 10**4.
+        local : boolean, optional
+            Extract a separate scalar feature per grid point. The default is False.
+        batches_per_chunk : int, optional
+            The number of mini batches drawn from a chunk before another chunk is read.
+            The default is None, in which case it is set such that every row of the
+            chunk is used once on average.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.arrays = arrays
+        self.start = start
+        self.stop = arrays[0].shape[0] if stop is None else stop
+        self.chunk_size = chunk_size
+        self.local = local
+        self.batches_per_chunk = batches_per_chunk
+
+        # the number of rows per sample
+        if local:
+            self.rows_per_sample = arrays[0].shape[1]
+            n_cols = len(arrays)
+        else:
+            self.rows_per_sample = 1
+            n_cols = int(np.sum([np.prod(X_i.shape[1:], dtype=int) for X_i in arrays]))
+
+        self.n_samples = self.stop - self.start
+        self.n_chunks = int(np.ceil(self.n_samples / chunk_size))
+        self.rows_per_chunk = chunk_size * self.rows_per_sample
+        self.shape = (self.n_samples * self.rows_per_sample, n_cols)
+        self.ndim = 2
+
+        # standardization, applied when a chunk is read
+        self.shift = 0.0
+        self.scale = 1.0
+        self.moments = None
+
+        self._empty_cache()
+
+    def _empty_cache(self):
+        """
+        Remove the chunk from memory and reset the mini batch counter.
+        """
+        self.chunk_idx = None
+        self.chunk = None
+        self.n_draws = 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        X = np.concatenate(list(self.chunks()))
+        if dtype is not None:
+            X = X.astype(dtype)
+        return X
+
+    def __getstate__(self):
+        # do not pickle the chunk in memory, and store HDF5 datasets by file and name
+        state = self.__dict__.copy()
+        state['chunk'] = None
+        state['chunk_idx'] = None
+        state['arrays'] = [(X_i.file.filename, X_i.name) if isinstance(X_i, h5py.Dataset)
+                           else X_i for X_i in self.arrays]
+        return state
+
+    def __setstate__(self, state):
+        # reopen the HDF5 datasets
+        state['arrays'] = [h5py.File(X_i[0], 'r')[X_i[1]] if isinstance(X_i, tuple)
+                           else X_i for X_i in state['arrays']]
+        self.__dict__.update(state)
+
+    def read_chunk(self, chunk_idx):
+        """
+        Read a chunk from disk, unless it is already in memory.
+
+        Parameters
+        ----------
+        chunk_idx : int
+            The index of the chunk.
+
+        Returns
+        -------
+        array
+            The rows of the chunk, of shape (n_rows_in_chunk, n_cols).
+
+        """
+        if chunk_idx == self.chunk_idx:
+            return self.chunk
+
+        begin = self.start + chunk_idx * self.chunk_size
+        end = min(begin + self.chunk_size, self.stop)
+
+        if self.local:
+            # array of shape (n_points, n_samples_in_chunk, n_arrays)
+            rows = np.stack([X_i[begin:end].T for X_i in self.arrays], axis=-1)
+            rows = rows.reshape([-1, len(self.arrays)])
+        else:
+            rows = np.concatenate([np.reshape(X_i[begin:end], [end - begin, -1])
+                                   for X_i in self.arrays], axis=1)
+
+        self.chunk_idx = chunk_idx
+        self.chunk = (rows - self.shift) / self.scale
+        return self.chunk
+
+    def __getitem__(self, idx):
+        """
+        Gather rows of the data set. Rows are read chunk by chunk, so indices that
+        lie in the chunk in memory are cheapest.
+
+        Parameters
+        ----------
+        idx : int, slice or array of int
+            The row indices.
+
+        Returns
+        -------
+        array
+            The rows, of shape (n_cols,) for an integer index and (n_rows, n_cols) otherwise.
+
+        """
+        if isinstance(idx, slice):
+            idx = np.arange(*idx.indices(self.shape[0]))
+        elif np.ndim(idx) == 0:
+            return self[np.array([idx])][0]
+
+        idx = np.asarray(idx).flatten()
+        chunk_of_row = idx // self.rows_per_chunk
+
+        rows = np.zeros([idx.size, self.shape[1]])
+        # read the chunk in memory first
+        chunks = np.unique(chunk_of_row)
+        chunks = sorted(chunks, key=lambda c: c != self.chunk_idx)
+        for c in chunks:
+            mask = chunk_of_row == c
+            rows[mask] = self.read_chunk(c)[idx[mask] - c * self.rows_per_chunk]
+
+        return rows
+
+    def chunks(self):
+        """
+        Generator over all chunks, in order.
+        """
+        for c in range(self.n_chunks):
+            yield self.read_chunk(c)
+
+    def sample(self, batch_size, sequential=False):
+        """
+        Draw the row indices of a mini batch from the chunk in memory. After
+        batches_per_chunk mini batches, a random new chunk is read.
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of rows.
+        sequential : boolean, optional
+            Return consecutive rows starting from a random row. The default is False.
+
+        Returns
+        -------
+        array
+            The row indices.
+
+        """
+        n_rows = self.rows_per_chunk
+        batches_per_chunk = self.batches_per_chunk
+        if batches_per_chunk is None:
+            batches_per_chunk = max(1, n_rows // batch_size)
+
+        # read a new chunk
+        if self.chunk_idx is None or self.n_draws >= batches_per_chunk:
+            self.read_chunk(np.random.randint(self.n_chunks))
+            self.n_draws = 0
+        self.n_draws += 1
+
+        n_rows = self.chunk.shape[0]
+        offset = self.chunk_idx * self.rows_per_chunk
+
+        if not sequential:
+            return offset + np.random.randint(0, n_rows, batch_size)
+
+        start = np.random.randint(0, n_rows - batch_size) if n_rows > batch_size else 0
+        return offset + np.arange(start, start + batch_size) % n_rows
+
+    def compute_moments(self):
+        """
+        Compute the column mean and standard deviation in a single pass over the chunks.
+
+        Returns
+        -------
+        RunningMoments
+            The moments of the data set.
+
+        """
+        if self.moments is None:
+            self.moments = RunningMoments(0.0, 0.0)
+            for rows in self.chunks():
+                self.moments.update(rows)
+        return self.moments
+
+    def mean(self, axis=0, **kwargs):
+        assert axis == 0, 'only axis=0 is supported'
+        return self.compute_moments().mean
+
+    def std(self, axis=0, **kwargs):
+        assert axis == 0, 'only axis=0 is supported'
+        return self.compute_moments().std
+
+    def standardize(self, mean, std):
+        """
+        Return a standardized view of the data set, which shares the on-disk arrays
+        with this object.
+
+        Parameters
+        ----------
+        mean : array
+            The mean to subtract from every row.
+        std : array
+            The standard deviation to divide every row by.
+
+        Returns
+        -------
+        ChunkedDataset
+            The standardized data set.
+
+        """
+        dataset = ChunkedDataset.__new__(ChunkedDataset)
+        dataset.__dict__.update(self.__dict__)
+        # combine with the present standardization, if any
+        dataset.shift = self.shift + mean * self.scale
+        dataset.scale = self.scale * std
+        dataset.moments = None
+        dataset._empty_cache()
+        return dataset
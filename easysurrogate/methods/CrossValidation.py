@@ -0,0 +1,210 @@
+"""
+Class for the cross validation of surrogates.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from .DataSplit import DataSplit
+
+# the raw data of a worker process, set by _init_worker
+_shared_data = None
+
+
+class CrossValidation:
+    """
+    K-fold cross validation of a surrogate. The samples are divided into n_folds folds,
+    either at random or in contiguous blocks (for time series). For every fold a
+    surrogate is trained on the other folds, passed as a DataSplit to the train
+    subroutine, and tested on the fold itself. The folds can be processed in parallel
+    in a process pool. The raw data is passed to every worker process once, and is
+    shared without copies if the processes are forked.
+    """
+
+    def __init__(self, surrogate, n_folds=5, blocked=False, gap=0, seed=None, n_jobs=1):
+        """
+        Create a CrossValidation object.
+
+        Parameters
+        ----------
+        surrogate : callable
+            Creates an untrained surrogate, e.g. es.methods.ANN_Surrogate, or
+            functools.partial(es.methods.GP_Surrogate, n_in=2).
+        n_folds : int, optional
+            The number of folds. The default is 5.
+        blocked : boolean, optional
+            If True the folds are contiguous blocks of samples, otherwise the samples
+            are assigned to the folds at random. The default is False.
+        gap : int, optional
+            In the case of blocked folds, the number of samples on either side of the
+            test block that are excluded from training, to reduce the correlation
+            between training and test samples of a time series. The default is 0.
+        seed : int, optional
+            Seed of the random number generator of the random folds. The default is None.
+        n_jobs : int, optional
+            The number of worker processes. The default is 1, meaning the folds are
+            processed in the current process.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.surrogate = surrogate
+        self.n_folds = n_folds
+        self.blocked = blocked
+        self.gap = gap
+        self.seed = seed
+        self.n_jobs = n_jobs
+
+    def folds(self, n_samples):
+        """
+        Create the train / test splits of all folds.
+
+        Parameters
+        ----------
+        n_samples : int
+            The number of samples.
+
+        Returns
+        -------
+        list of DataSplit
+            The split of every fold.
+
+        """
+        assert 2 <= self.n_folds <= n_samples, "n_folds must be in [2, n_samples]"
+
+        if self.blocked:
+            test_folds = np.array_split(np.arange(n_samples), self.n_folds)
+        else:
+            rng = np.random.default_rng(self.seed)
+            test_folds = np.array_split(rng.permutation(n_samples), self.n_folds)
+
+        splits = []
+        for test_idx in test_folds:
+            train_mask = np.ones(n_samples, dtype=bool)
+            if self.blocked:
+                train_mask[max(test_idx[0] - self.gap, 0):test_idx[-1] + self.gap + 1] = False
+            else:
+                train_mask[test_idx] = False
+            split = DataSplit(n_samples, index=np.flatnonzero(train_mask))
+            # the samples in the gap are neither used for training nor for testing
+            split.test_indices = np.sort(test_idx)
+            split.n_test = split.test_indices.size
+            splits.append(split)
+
+        return splits
+
+    def run(self, feats, target, return_surrogates=False, **train_kwargs):
+        """
+        Train and test a surrogate for every fold.
+
+        Parameters
+        ----------
+        feats : array or list of arrays
+            The feature arrays, each of shape (n_samples, n_points_i).
+        target : array
+            The target data, of shape (n_samples, n_target).
+        return_surrogates : boolean, optional
+            Also return the trained surrogates. The default is False.
+        **train_kwargs : keyword arguments of the train subroutine of the surrogate,
+            e.g. n_iter. Time-lagged and local surrogates are not supported.
+
+        Returns
+        -------
+        dict
+            The results, containing the per-fold root mean squared error 'rmse', the
+            per-fold root mean squared error per output 'rmse_per_output', the per-fold
+            rmse relative to the standard deviation of the test targets 'rel_rmse', their
+            mean and standard deviation over the folds ('rmse_mean', 'rmse_std',
+            'rel_rmse_mean', 'rel_rmse_std'), the 'splits' and, if return_surrogates is
+            True, the 'surrogates'.
+
+        """
+        assert train_kwargs.get('lags') is None, \
+            "Cross validation is not supported for time-lagged surrogates"
+        assert not train_kwargs.get('local', False), \
+            "Cross validation is not supported for local surrogates"
+
+        if not isinstance(feats, list):
+            feats = [feats]
+
+        splits = self.folds(feats[0].shape[0])
+        tasks = [(split, self.surrogate, train_kwargs, return_surrogates) for split in splits]
+
+        if self.n_jobs > 1:
+            with ProcessPoolExecutor(max_workers=min(self.n_jobs, self.n_folds),
+                                     initializer=_init_worker,
+                                     initargs=(feats, target, True)) as executor:
+                fold_results = list(executor.map(_run_fold, *zip(*tasks)))
+        else:
+            _init_worker(feats, target)
+            fold_results = [_run_fold(*task) for task in tasks]
+
+        results = {'splits': splits}
+        for name in ['rmse', 'rmse_per_output', 'rel_rmse']:
+            results[name] = np.array([result[name] for result in fold_results])
+        for name in ['rmse', 'rel_rmse']:
+            results[name + '_mean'] = np.mean(results[name])
+            results[name + '_std'] = np.std(results[name])
+        if return_surrogates:
+            results['surrogates'] = [result['surrogate'] for result in fold_results]
+
+        print('%d-fold cross validation: rmse = %.4e +/- %.4e, relative rmse = %.4e +/- %.4e' %
+              (self.n_folds, results['rmse_mean'], results['rmse_std'],
+               results['rel_rmse_mean'], results['rel_rmse_std']))
+
+        self.results = results
+        return results
+
+
+def _init_worker(feats, target, reseed=False):
+    """
+    Store the raw data in the worker process, as read-only views. Forked worker processes
+    inherit the state of the global random number generator, which is reseeded if
+    reseed is True.
+    """
+    global _shared_data
+    if reseed:
+        np.random.seed()
+    feats = [np.asarray(X_i).view() for X_i in feats]
+    target = np.asarray(target).view()
+    for X in feats + [target]:
+        X.flags.writeable = False
+    _shared_data = (feats, target)
+
+
+def _run_fold(split, surrogate, train_kwargs, return_surrogate):
+    """
+    Train a surrogate on the training samples of a split, and compute its error on the
+    test samples. The test samples are predicted at once with the batched _feed_forward
+    subroutine of the surrogate, or one by one with predict if it has none.
+    """
+    feats, target = _shared_data
+
+    model = surrogate()
+    model.train(feats, target, split=split, **train_kwargs)
+
+    y_test = target[split.test_indices].reshape([split.n_test, -1])
+
+    if hasattr(model, '_feed_forward'):
+        # the feature matrix of all test samples, shape (n_test, n_in)
+        X_test = np.concatenate([X_i[split.test_indices].reshape([split.n_test, -1])
+                                 for X_i in feats], axis=1)
+        if getattr(model, 'projection', None) is not None:
+            X_test = model.projection.transform(X_test)
+        y_pred = model._feed_forward(X_test)
+    else:
+        y_pred = [model.predict(np.concatenate([X_i[j] for X_i in feats]))
+                  for j in split.test_indices]
+    y_pred = np.asarray(y_pred).reshape(y_test.shape)
+
+    rmse_per_output = np.sqrt(np.mean((y_pred - y_test)**2, axis=0))
+    rmse = np.sqrt(np.mean((y_pred - y_test)**2))
+    std = np.std(y_test)
+    result = {'rmse': rmse, 'rmse_per_output': rmse_per_output,
+              'rel_rmse': rmse / std if std > 0.0 else np.inf}
+    if return_surrogate:
+        result['surrogate'] = model
+    return result
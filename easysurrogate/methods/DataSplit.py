@@ -0,0 +1,66 @@
+"""
+Class for a train / test split of a data set.
+"""
+
+import numpy as np
+
+
+class DataSplit:
+    """
+    Train / test split of the samples of a data set, stored as a boolean mask and the
+    corresponding index arrays. A DataSplit object can be passed to several surrogates
+    that are trained on the same data, such that the split is computed only once.
+    """
+
+    def __init__(self, n_samples, test_frac=0.0, train_first=True, index=None, seed=None):
+        """
+        Create a DataSplit object.
+
+        Parameters
+        ----------
+        n_samples : int
+            The number of samples in the data set.
+        test_frac : float, optional
+            The fraction of the data that is withheld from training.
+            The default is 0.0, and it must be in [0.0, 1.0].
+        train_first : boolean, optional
+            If True use the first (1.0 - test_frac) samples for training, otherwise
+            choose the training samples at random. The default is True.
+        index : array of int, optional
+            The indices of the training samples. If specified, test_frac and
+            train_first are ignored. The default is None.
+        seed : int, optional
+            Seed of the random number generator, used if train_first is False.
+            The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.n_samples = n_samples
+
+        if index is not None:
+            self.train_indices = np.asarray(index)
+            self.train_mask = np.zeros(n_samples, dtype=bool)
+            self.train_mask[self.train_indices] = True
+        else:
+            n_train = round(n_samples * (1.0 - test_frac))
+            self.train_mask = np.zeros(n_samples, dtype=bool)
+            if train_first:
+                # chose train fraction from first samples
+                self.train_mask[0:n_train] = True
+            else:
+                # chose train fraction at random without replacement
+                rng = np.random if seed is None else np.random.default_rng(seed)
+                self.train_mask[rng.choice(n_samples, n_train, replace=False)] = True
+            self.train_indices = np.flatnonzero(self.train_mask)
+
+        self.test_indices = np.flatnonzero(~self.train_mask)
+        self.n_train = self.train_indices.size
+        self.n_test = self.test_indices.size
+
+    @property
+    def test_mask(self):
+        return ~self.train_mask
@@ -6,10 +6,19 @@ CLASS FOR FEATURE ENGINEERING SUBROUTINES
 
 import numpy as np
 from itertools import chain
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from scipy import stats
+from scipy.stats import qmc
 
 from scipy.optimize import minimize
-import statistics
+from scipy.spatial import cKDTree
+
+from .ReplayBuffer import ReplayBuffer
+from .LaggedDataset import LaggedDataset
+from .DataSplit import DataSplit
+from .ChunkedDataset import ChunkedDataset
+from .ImportanceSampler import ImportanceSampler
 
 
 class Feature_Engineering:
@@ -22,8 +31,13 @@ class Feature_Engineering:
         print('Creating Feature Engineering object')
         self.lags = None
         self.local = False
+        # the number of ensemble members that share the feature history, None if the
+        # history follows a single trajectory
+        self.n_members = None
+        # the neighbourhood of a local surrogate, None if only the point itself is used
+        self.stencil = None
 
-    def _predict(self, X, feed_forward):
+    def _predict(self, X, feed_forward, vectorized=False):
         """
         Contains the generic processing of features that is independent of the chosen surrogate
         method. Features are processed depending upon the presence of time lags or the local /
@@ -36,17 +50,146 @@ class Feature_Engineering:
             The feature array or list of feature arrays on which to evaluate the surrogate.
         feed_forward : function
             The prediction function that is specific to a particular surrogate.
+        vectorized : boolean, optional
+            If True, feed_forward accepts an array of shape (n_samples, n_in) and returns
+            an array of shape (n_samples, n_out). In the case of a local surrogate, the
+            features of all points are then evaluated in a single call. The default is False.
 
         Returns
         -------
         array
         feed_forward(X)
 
+        """
+        feats, local = self._predict_features(X)
+        return self._feed_forward_features(feats, local, feed_forward, vectorized)
+
+    def _predict_features(self, X):
+        """
+        Process the features of a prediction, see _predict. In the case of a time-lagged
+        surrogate, X is appended to the feature history. The processed features can be
+        passed to the feed_forward methods of several surrogates that share this
+        Feature_Engineering object, see Campaign.add_surrogate.
+
+        Parameters
+        ----------
+        X : array or list of arrays
+            The feature array or list of feature arrays on which to evaluate the surrogate.
+
+        Returns
+        -------
+        feats : array
+            The input features, of shape (n_in,), or (n_points, n_in) in the case of a
+            local surrogate. The features of an ensemble have a leading dimension
+            of size n_members.
+        local : boolean
+            True if the surrogate is applied locally.
+
         """
 
         if not isinstance(X, list):
             X = [X]
 
+        n_members = getattr(self, 'n_members', None)
+
+        # the features are only validated once for every new combination of feature shapes
+        if n_members is None:
+            local, n_points = self._validate_predict_features(X)
+        else:
+            # the features of an ensemble have a leading dimension of size n_members
+            local, n_points = self._validate_predict_features([X_i[0] for X_i in X])
+
+        # time-lagged surrogate
+        if self.lags is not None:
+
+            # append the current state X to the feature history
+            self.append_feat(X)
+
+            # if not local, get entire feature vector
+            if not local:
+                return self.get_feat_history(), local
+            # if local, get the features of all points at once
+            return self.get_feat_history(index=np.arange(n_points)), local
+        # no lags and non local, create a single vector of X
+        if not local:
+            return np.concatenate(X), local
+        # no lags and local, the features of all points
+        if getattr(self, 'stencil', None) is None:
+            # if passed list of features [n_samples x n_grid_points]
+            return np.array(X).reshape([len(X), n_points]).T, local
+        # gather the neighbourhood features of all points, shape (n_points, n_in)
+        return np.concatenate([self._neighbourhood(X_i.reshape(-1), i)
+                               for i, X_i in enumerate(X)], axis=1), local
+
+    def _feed_forward_features(self, feats, local, feed_forward, vectorized=False):
+        """
+        Evaluate a surrogate-specific feed_forward method on the features returned by
+        _predict_features.
+
+        Parameters
+        ----------
+        feats : array
+            The processed features.
+        local : boolean
+            The surrogate is applied locally.
+        feed_forward : function
+            The prediction function that is specific to a particular surrogate.
+        vectorized : boolean, optional
+            If True, the features of all (ensemble members and) local points are
+            evaluated in a single call of feed_forward. The default is False.
+
+        Returns
+        -------
+        array
+            The prediction. The predictions of an ensemble are of shape (n_members, n_out),
+            with n_out = n_points in the case of a local surrogate.
+
+        """
+        # ensemble of trajectories, return the predictions of all members
+        if self.lags is not None and getattr(self, 'n_members', None) is not None:
+            if vectorized:
+                y = feed_forward(feats.reshape([-1, feats.shape[-1]]))
+            else:
+                y = np.array([feed_forward(feat)
+                              for feat in feats.reshape([-1, feats.shape[-1]])])
+            return y.reshape([self.n_members, -1])
+
+        # if not local, feed forward the entire feature vector
+        if not local:
+            return feed_forward(feats)
+        # if local and vectorized, feed forward the features of all points at once
+        if vectorized:
+            return feed_forward(feats).flatten()
+        # if local, loop over the points and feed forward every feature vector
+        y = []
+        for feat in feats:
+            y.append(feed_forward(feat))  # GP case: for single sample should be one point
+        return np.array(y).flatten()
+
+    def _validate_predict_features(self, X):
+        """
+        Check the shapes of the features passed to _predict. The result is cached, such
+        that repeated predictions with features of the same shapes, e.g. in a coupled
+        time stepping loop, skip the validation.
+
+        Parameters
+        ----------
+        X : list of arrays
+            The feature arrays on which to evaluate the surrogate.
+
+        Returns
+        -------
+        local : boolean
+            True if the features are 2 dimensional, i.e. the surrogate is applied locally.
+        n_points : int or None
+            The number of local points, None if not local.
+
+        """
+        shapes = tuple(X_i.shape for X_i in X)
+        predict_plan = getattr(self, 'predict_plan', None)
+        if predict_plan is not None and predict_plan[0] == shapes:
+            return predict_plan[1]
+
         # make sure all feature vectors have the same ndim.
         # This will raise an error when for instance X1.shape = (10,) and X2.shape = (10, 1)
         ndims = [X_i.ndim for X_i in X]
@@ -58,6 +201,7 @@ class Feature_Engineering:
         # in the case of two dimensional arrays, make are the second dimension is the same
         # for all features. This dimension must equal the grid size
         local = False
+        n_points = None
         if ndims[0] == 2:
             local = True
             shapes1 = [X_i.shape[1] for X_i in X]
@@ -67,53 +211,325 @@ class Feature_Engineering:
             # dimension in order to make a single prediction
             n_points = shapes1[0]
 
-        # time-lagged surrogate
-        if self.lags is not None:
+        self.predict_plan = (shapes, (local, n_points))
 
-            # append the current state X to the feature history
-            self.append_feat(X)
+        return local, n_points
 
-            # if not local, get entire feature vector and feed forward
-            if not local:
-                feat = self.get_feat_history()
-                return feed_forward(feat)
-            # if local, loop over the 2nd dimension of the feature vector and feed forward
-            # every entry
-            else:
-                y = []
-                for p in range(n_points):
-                    feat = self.get_feat_history(index=p)
-                    y.append(feed_forward(feat))
-                return np.array(y).flatten()
-        # no lags
+    def filter_values(self, feats, interval=None, thin=False, threshold=np.exp(-1)):
+        """
+        Choose only those samples for which the feature values lie within the given
+        intervals, and / or thin the (time) samples to the decorrelation time of the
+        features. The resulting indices can be passed to get_training_data(index=...).
+
+        Parameters
+        ----------
+        feats : array or list of arrays
+            A single feature array or a list of different feature arrays, each of
+            shape (n_samples, n_points_i) or (n_samples,).
+        interval : list, optional
+            The interval (lower, upper) of each feature, or None for a feature that is not
+            filtered. A sample is kept if all values of the feature lie in [lower, upper].
+            The default is None, meaning no interval filter.
+        thin : boolean, optional
+            If True, keep every tau-th sample only, where tau is the decorrelation time
+            computed by decorrelation_time. The default is False.
+        threshold : float, optional
+            The autocorrelation threshold that defines the decorrelation time.
+            The default is exp(-1).
+
+        Returns
+        -------
+        array of int
+            The indices of the selected samples, in increasing order.
+
+        """
+        if not isinstance(feats, list):
+            feats = [feats]
+
+        n_samples = feats[0].shape[0]
+        mask = np.ones(n_samples, dtype=bool)
+
+        if interval is not None:
+            assert len(interval) == len(feats), 'Error: no specified interval for one of the features'
+            for X_i, interval_i in zip(feats, interval):
+                if interval_i is None:
+                    continue
+                X_i = X_i.reshape([n_samples, -1])
+                mask &= np.all((X_i >= interval_i[0]) & (X_i <= interval_i[1]), axis=1)
+
+        if thin:
+            tau = self.decorrelation_time(feats, threshold=threshold)
+            print('Decorrelation time = %d samples' % tau)
+            mask[np.arange(n_samples) % tau != 0] = False
+
+        index = np.flatnonzero(mask)
+        print('Selected %d/%d samples' % (index.size, n_samples))
+
+        return index
+
+    def decorrelation_time(self, feats, threshold=np.exp(-1)):
+        """
+        Estimate the decorrelation time of (time) series of features, as the first lag at
+        which the autocorrelation function drops below a threshold. The autocorrelation
+        function is computed with FFTs for all columns at once, and averaged over the
+        columns of every feature. The largest decorrelation time of all features is
+        returned.
+
+        Parameters
+        ----------
+        feats : array or list of arrays
+            A single feature array or a list of different feature arrays, each of
+            shape (n_samples, n_points_i) or (n_samples,).
+        threshold : float, optional
+            The autocorrelation threshold. The default is exp(-1).
+
+        Returns
+        -------
+        int
+            The decorrelation time in number of samples, at least 1.
+
+        """
+        if not isinstance(feats, list):
+            feats = [feats]
+
+        n_samples = feats[0].shape[0]
+        # zero padding to avoid the circular correlation of the FFT
+        n_fft = 2**int(np.ceil(np.log2(2 * n_samples - 1)))
+
+        tau = 1
+        for X_i in feats:
+            X_i = X_i.reshape([n_samples, -1])
+            X_i = X_i - np.mean(X_i, axis=0)
+            X_hat = np.fft.rfft(X_i, n=n_fft, axis=0)
+            acf = np.fft.irfft(X_hat.real**2 + X_hat.imag**2, n=n_fft, axis=0)[0:n_samples]
+            # skip constant columns
+            var = acf[0]
+            if not np.any(var > 0.0):
+                continue
+            acf = np.mean(acf[:, var > 0.0] / var[var > 0.0], axis=1)
+            below = np.flatnonzero(acf < threshold)
+            tau_i = below[0] if below.size > 0 else n_samples
+            tau = max(tau, tau_i)
+
+        return int(tau)
+
+    def select_subset(self, feats, n_select, method='farthest', n_bins=10, n_iter=20,
+                      seed=None):
+        """
+        Select a representative subset of n_select samples, e.g. to cap the size of
+        the training set of a Gaussian process. The selection is made on the
+        standardized feature vectors of the samples. The resulting indices can be passed
+        to get_training_data(index=...).
+
+        Parameters
+        ----------
+        feats : array or list of arrays
+            A single feature array or a list of different feature arrays, each of
+            shape (n_samples, n_points_i) or (n_samples,). The target can be included
+            as well, to select samples that also cover the output space.
+        n_select : int
+            The number of samples to select.
+        method : string, optional
+            The selection method:
+                - 'farthest': greedy max-min distance selection. Every new sample is the
+                  one farthest from the samples selected so far.
+                - 'kmeans': the samples nearest to the centroids of n_select k-means
+                  clusters.
+                - 'bins': an equal number of random samples from every occupied cell of
+                  a grid with n_bins equal-width bins per feature.
+            The default is 'farthest'.
+        n_bins : int, optional
+            The number of bins per feature of the 'bins' method. The default is 10.
+        n_iter : int, optional
+            The number of k-means iterations of the 'kmeans' method. The default is 20.
+        seed : int, optional
+            Seed of the random number generator. The default is None.
+
+        Returns
+        -------
+        array of int
+            The indices of the selected samples, in increasing order.
+
+        """
+        if not isinstance(feats, list):
+            feats = [feats]
+
+        n_samples = feats[0].shape[0]
+        if n_select >= n_samples:
+            return np.arange(n_samples)
+
+        # standardized feature vectors, one row per sample
+        X = np.concatenate([X_i.reshape([n_samples, -1]) for X_i in feats], axis=1)
+        X = X.astype('float64')
+        std = np.std(X, axis=0)
+        std[std == 0.0] = 1.0
+        X = (X - np.mean(X, axis=0)) / std
+
+        rng = np.random.default_rng(seed)
+
+        if method == 'farthest':
+            # start from the sample closest to the mean
+            dist = np.einsum('ij,ij->i', X, X)
+            index = [np.argmin(dist)]
+            # the squared distance of every sample to the selected samples
+            dist = np.full(n_samples, np.inf)
+            for _ in range(n_select - 1):
+                diff = X - X[index[-1]]
+                np.minimum(dist, np.einsum('ij,ij->i', diff, diff), out=dist)
+                index.append(np.argmax(dist))
+            index = np.array(index)
+        elif method == 'kmeans':
+            # Lloyd iterations, starting from random samples. The nearest centroids are
+            # found with a KD-tree of the centroids.
+            centroids = X[rng.choice(n_samples, n_select, replace=False)]
+            for _ in range(n_iter):
+                _, cluster = cKDTree(centroids).query(X)
+                count = np.bincount(cluster, minlength=n_select)
+                sums = np.stack([np.bincount(cluster, weights=X_j, minlength=n_select)
+                                 for X_j in X.T], axis=1)
+                # empty clusters keep their centroid
+                nonempty = count > 0
+                centroids[nonempty] = sums[nonempty] / count[nonempty, np.newaxis]
+            # map every centroid to the nearest sample that has not been selected yet
+            tree = cKDTree(X)
+            _, nearest = tree.query(centroids, k=min(n_samples, 16))
+            selected = np.zeros(n_samples, dtype=bool)
+            for candidates in nearest:
+                free = candidates[~selected[candidates]]
+                if free.size > 0:
+                    selected[free[0]] = True
+            index = np.flatnonzero(selected)
+        elif method == 'bins':
+            # the cell of every sample
+            X_min = np.min(X, axis=0)
+            width = (np.max(X, axis=0) - X_min) / n_bins
+            width[width == 0.0] = 1.0
+            cells = np.clip(np.floor((X - X_min) / width), 0, n_bins - 1).astype(int)
+            _, cell_idx = np.unique(cells, axis=0, return_inverse=True)
+            cell_idx = cell_idx.flatten()
+            # a random rank of every sample within its cell
+            order = np.lexsort((rng.random(n_samples), cell_idx))
+            cell_start = np.searchsorted(cell_idx[order], cell_idx[order])
+            rank = np.empty(n_samples, dtype=int)
+            rank[order] = np.arange(n_samples) - cell_start
+            # take the samples of rank 0 of all cells first, then those of rank 1, etc.
+            index = np.lexsort((rng.random(n_samples), rank))[0:n_select]
         else:
-            # no lags and non local, create a single vector of X and feed forward
-            if not local:
-                feat = np.concatenate(X)
-                return feed_forward(feat)
-            # no lags and local, get feature vector and loop over 2nd dimension
-            else:
-                # if passed list of features [n_samples x n_grid_points]
-                X = np.array(X).reshape([n_points, len(X)])
-                #X_train.append(np.moveaxis(np.array(X[i]), 0, -1).reshape([self.n_train, -1]))
-                y = []
-                for p in range(n_points):
-                    y.append(feed_forward(X[p]))  # GP case: for single sample should be one point
-                return np.array(y).flatten()
+            raise ValueError("method must be 'farthest', 'kmeans' or 'bins'")
+
+        print('Selected %d/%d samples' % (len(index), n_samples))
+
+        return np.sort(index)
 
-    def filter_values(self, feats, interval):
+    def subset_split(self, feats, n_select, method='farthest', **kwargs):
         """
-        Choose only those samples for which feature value lies
-        Args:
-            feats:
-            interval:
+        Create a train / test split in which the training samples are a representative
+        subset of the data, see select_subset. The remaining samples are test samples.
 
-        Returns:
+        Parameters
+        ----------
+        feats : array or list of arrays
+            The feature arrays, see select_subset.
+        n_select : int
+            The number of training samples.
+        method : string, optional
+            The selection method, see select_subset. The default is 'farthest'.
+        **kwargs : the keyword arguments of select_subset.
+
+        Returns
+        -------
+        DataSplit
+            The split, which can be passed to get_training_data(split=...).
+
+        """
+        if not isinstance(feats, list):
+            feats = [feats]
+        index = self.select_subset(feats, n_select, method=method, **kwargs)
+        return DataSplit(feats[0].shape[0], index=index)
+
+    def inverse_density_weights(self, target, n_bins=20, power=1.0):
+        """
+        Weights of the samples that are inversely proportional to the density of the
+        target, estimated with a histogram of n_bins equidistant bins per variable. For
+        a heavy-tailed target, the rare samples in the tails get large weights. In the
+        case of several target variables, a sample gets the largest weight over its
+        variables.
+
+        Parameters
+        ----------
+        target : array
+            The target data, of shape (n_samples, n_vars) or (n_samples,).
+        n_bins : int, optional
+            The number of bins per variable. The default is 20.
+        power : float, optional
+            Exponent of the inverse density. Use power < 1 to temper the weights of
+            the tails, power = 0 gives uniform weights. The default is 1.0.
+
+        Returns
+        -------
+        array
+            The weights, of shape (n_samples,), normalized to a mean of 1.
+
+        """
+        target = np.asarray(target)
+        n_samples = target.shape[0]
+        y = target.reshape([n_samples, -1])
+
+        weights = np.zeros(n_samples)
+        for y_j in y.T:
+            counts, edges = np.histogram(y_j, bins=n_bins)
+            # the last bin includes the right edge, as in np.histogram
+            bin_idx = np.clip(np.searchsorted(edges, y_j, side='right') - 1, 0, n_bins - 1)
+            np.maximum(weights, (n_samples / (n_bins * counts[bin_idx]))**power, out=weights)
 
+        return weights / np.mean(weights)
+
+    def importance_sampler(self, target, sample_weights, n_bins=20, uniform_frac=0.1):
         """
+        Create the ImportanceSampler of the mini batches of a neural network.
+
+        Parameters
+        ----------
+        target : array
+            The training target, of shape (n_train, n_vars).
+        sample_weights : string or array
+            'density' for the inverse density of the binned target, see
+            inverse_density_weights, 'loss' for weights given by the current loss value
+            of every sample, or an array with the weight of every training sample.
+        n_bins : int, optional
+            The number of bins of the 'density' weights. The default is 20.
+        uniform_frac : float, optional
+            Fraction of the uniform distribution in the sampling probabilities, see
+            ImportanceSampler. The default is 0.1.
+
+        Returns
+        -------
+        ImportanceSampler
+            The sampler, which can be passed to ANN.train(sampler=...).
+
+        """
+        assert not isinstance(target, ChunkedDataset), \
+            "Importance sampling is not supported for out-of-core training data"
+
+        n_train = target.shape[0]
+        if isinstance(sample_weights, str):
+            assert sample_weights in ['density', 'loss'], \
+                "sample_weights must be 'density', 'loss' or an array"
+            if sample_weights == 'density':
+                return ImportanceSampler(self.inverse_density_weights(target, n_bins),
+                                         uniform_frac=uniform_frac)
+            # start from uniform weights, which are replaced by the loss values
+            return ImportanceSampler(np.ones(n_train), uniform_frac=uniform_frac,
+                                     adaptive=True)
+
+        assert np.size(sample_weights) == n_train, \
+            "Expected %d sample weights, got %d" % (n_train, np.size(sample_weights))
+        return ImportanceSampler(sample_weights, uniform_frac=uniform_frac)
 
     def chose_feature_from_acquisition(self, acquisition_function, X_cands,
-                                       candidate_search=True, n_new_cands=1):
+                                       candidate_search=True, n_new_cands=1,
+                                       vectorized=False, believer=None,
+                                       n_starts=16, start_design='lhs', n_jobs=1, jac=None):
         """
         Returns a new parameter value as a minimum of acquisition function, as well as its index among suggested
         candidates index in surrogate test set.
@@ -135,33 +551,105 @@ class Feature_Engineering:
         candidate_search: boolean, if True search among the list of candidate values,
             if False generate new value within boundary box as minimum using scipy.minimize()
         n_new_cands: integer, number of new candidate input points to return
+        vectorized: boolean, if True the acquisition function accepts the array of all
+            candidates, of shape (n_cands, n_in), and returns an array of n_cands values.
+            It is then evaluated once per selected point, instead of once per candidate.
+        believer: callable, optional. Only used if n_new_cands > 1. If specified, it is
+            called with every selected point, and must condition the surrogate on this
+            pending point (e.g. kriging believer), before the next point is selected with
+            the updated acquisition function. If None, the n_new_cands candidates with the
+            lowest acquisition values are selected.
+        n_starts: integer, number of starting points of the local optimizations,
+            if candidate_search is False. The default is 16.
+        start_design: string, the design of the starting points in the bounding box of
+            the candidates, 'lhs' (Latin hypercube) or 'sobol'. The default is 'lhs'.
+        n_jobs: integer, number of processes over which the starting points are divided.
+            The acquisition function must be picklable if n_jobs > 1. The default is 1.
+        jac: callable, optional. The analytic gradient of the acquisition function,
+            used by the local optimizations. If None and vectorized is True, a forward
+            difference gradient is computed with a single call of the acquisition function.
+            Otherwise scipy's finite differences are used.
 
         Returns
         -------
-        array
-        feed_forward(X)
+        x_min : the new sample, or an array of n_new_cands new samples if n_new_cands > 1
+        x_min_ind_test : its index among the candidates, or an array of indices
+        x_min_ind_glob : its index among all samples (self.test_indices), or an array of indices
         """
 
         if candidate_search:
 
-            cand_vals = [acquisition_function(x) for x in X_cands]
-            x_min_ind_test = np.argmin(np.array(cand_vals))
+            X_cands = np.array(X_cands)
+
+            def evaluate(X):
+                if vectorized:
+                    return np.array(acquisition_function(X)).reshape(X.shape[0])
+                return np.array([acquisition_function(x) for x in X]).reshape(X.shape[0])
+
+            if n_new_cands == 1:
+                x_min_ind_test = np.argmin(evaluate(X_cands))
+            elif believer is None:
+                # the candidates with the n_new_cands lowest acquisition values
+                cand_vals = evaluate(X_cands)
+                x_min_ind_test = np.argsort(cand_vals, kind='stable')[0:n_new_cands]
+            else:
+                # greedy batch selection, conditioning the surrogate on every selected point
+                remaining = np.ones(X_cands.shape[0], dtype=bool)
+                x_min_ind_test = []
+                for _ in range(n_new_cands):
+                    idx = np.flatnonzero(remaining)
+                    j = idx[np.argmin(evaluate(X_cands[idx]))]
+                    x_min_ind_test.append(j)
+                    remaining[j] = False
+                    believer(X_cands[j])
+                x_min_ind_test = np.array(x_min_ind_test)
+
             x_min = X_cands[x_min_ind_test]
             x_min_ind_glob = self.test_indices[x_min_ind_test]
 
         else:
-            boundminima = np.array(X_cands).min(axis=0)
-            boundmaxima = np.array(X_cands).max(axis=0)
-            currbounds = []
-            for i in range(self.n_dim):
-                currbounds.append((boundminima[i], boundmaxima[i]))
+            X_cands = np.array(X_cands)
+            bounds = np.array([X_cands.min(axis=0), X_cands.max(axis=0)]).T
+            n_dim = bounds.shape[0]
+
+            # space-filling starting points in the bounding box of the candidates
+            if start_design == 'sobol':
+                design = qmc.Sobol(d=n_dim, scramble=True)
+            else:
+                design = qmc.LatinHypercube(d=n_dim)
+            starts = qmc.scale(design.random(n_starts), bounds[:, 0], bounds[:, 1])
 
-            opt_start_point = [statistics.mean(x) for x in currbounds]
+            if jac is None and vectorized:
+                fun = partial(_acquisition_with_gradient, acquisition_function, bounds=bounds)
+                jac = True
+            else:
+                fun = acquisition_function
+
+            # run the local optimizations, distributed over n_jobs processes
+            if n_jobs > 1:
+                with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                    results = pool.map(partial(_minimize_from_starts, fun, jac=jac,
+                                               bounds=bounds),
+                                       np.array_split(starts, n_jobs))
+                    results = list(chain(*results))
+            else:
+                results = _minimize_from_starts(fun, starts, jac=jac, bounds=bounds)
+
+            # keep the best distinct optima, compared in the unit hypercube
+            width = bounds[:, 1] - bounds[:, 0]
+            width[width == 0.0] = 1.0
+            x_min = []
+            for x, _ in sorted(results, key=lambda result: result[1]):
+                if all(np.linalg.norm((x - x_j) / width) > 1e-3 for x_j in x_min):
+                    x_min.append(x)
+                if len(x_min) == n_new_cands:
+                    break
 
-            newpoints = minimize(acquisition_function, np.array(opt_start_point),
-                                 bounds=currbounds)  # bounds for current GP case
-            if newpoints.success:
-                x_min = newpoints['x']
+            if len(x_min) < n_new_cands:
+                print('Found only %d distinct optima' % len(x_min))
+                n_new_cands = len(x_min)
+
+            x_min = x_min[0] if n_new_cands == 1 else np.array(x_min)
 
             x_min_ind_test = 0
             x_min_ind_glob = 0
@@ -170,6 +658,29 @@ class Feature_Engineering:
 
         return x_min, x_min_ind_test, x_min_ind_glob
 
+    def _neighbourhood(self, X_i, i):
+        """
+        Gather the neighbourhood features of feature i at every grid point, using the
+        precomputed neighbour indices of the stencil.
+
+        Parameters
+        ----------
+        X_i : array
+            The feature array, of shape (..., n_points).
+        i : int
+            The index of the feature.
+
+        Returns
+        -------
+        array
+            The neighbourhood features, of shape (..., n_points, n_offsets_i). Without
+            a stencil this is a view of X_i of shape (..., n_points, 1).
+
+        """
+        if getattr(self, 'stencil', None) is None:
+            return X_i[..., np.newaxis]
+        return X_i[..., self.stencil.indices(X_i.shape[-1])[i]]
+
     def get_training_data(
             self,
             feats,
@@ -179,7 +690,12 @@ class Feature_Engineering:
             test_frac=0.0,
             valid_frac=0.0,
             train_first=True,
-            index=None):
+            index=None,
+            lazy=False,
+            split=None,
+            cache=None,
+            stencil=None,
+            dtype=None):
         """
         Generate training data. Training data can be made (time) lagged and/or local.
 
@@ -211,7 +727,31 @@ class Feature_Engineering:
             The default is 0.0, and it must be in [0.0, 1.0].
         train_first: boolean, if True then use first (1.0-test_frac) samples for training,
             otherwise chose training sample at random
-        index: list of inidices of data samples to be chosen for training set
+        index: list of inidices of data samples to be chosen for training set, e.g.
+            obtained from filter_values
+        lazy: boolean, optional
+            If True and lags are specified, X_train and X_test are returned as LaggedDataset
+            objects, which only store the raw feature time series and gather the lagged
+            feature vectors on the fly. The default is False.
+        split: DataSplit, optional
+            A precomputed train / test split, e.g. of another surrogate trained on the same
+            data (feat_eng.split). If specified, test_frac, train_first and index are
+            ignored. The default is None.
+        cache: TrainingDataCache, optional
+            If specified, the prepared training data is stored in / loaded from this cache,
+            keyed on the feats, target and the parameters above. On a cache hit, the
+            arrays are returned as read-only memory maps. A random split is reused from
+            the cache as well. Not used if lazy is True. The default is None.
+        stencil: Stencil, optional
+            In the case of a local surrogate, the input features of a point are the features
+            at the neighbouring points given by the stencil offsets, also in _predict.
+            The default is None, meaning the features at the point itself only.
+        dtype: data type, optional
+            The storage data type of the feature arrays, e.g. 'float32' or 'float16' to
+            reduce the memory footprint of the training data. The features are converted
+            while they are gathered, without a full-precision copy of the training data.
+            The target data is not converted. The default is None, meaning the data type
+            of the feats.
 
         Returns
         -------
@@ -224,146 +764,288 @@ class Feature_Engineering:
         if not isinstance(feats, list):
             feats = [feats]
 
+        assert stencil is None or local, "A stencil can only be used with local=True"
+        assert stencil is None or len(stencil.offsets) == len(feats), \
+            "The stencil must contain the offsets of every feature"
+
+        if cache is not None and not lazy:
+            return self._get_cached_training_data(
+                cache, feats, target, lags=lags, local=local, test_frac=test_frac,
+                valid_frac=valid_frac, train_first=train_first, index=index, split=split,
+                stencil=stencil, dtype=dtype)
+
+        self.stencil = stencil
+
         # the number of distinct feature arrays
         self.n_feat_arrays = len(feats)
 
         # flag if the surrogate is to be applied locally or not
         self.local = local
 
-        # initialize storage for online training
-        self.online_feats = [[] for i in range(self.n_feat_arrays)]
-        self.online_target = []
-
         # number of training samples
         self.n_samples = feats[0].shape[0]
         # number of points in the computational grid
         self.n_points = feats[0].shape[1]
 
-        # Depends on the way the test points are chosen
-        # compute the size of the training set based on value of test_frac
-        self.n_train = round(self.n_samples * (1.0 - test_frac))
-        # number of testing points, as what is left after excluding training set
-        self.n_test = np.int(self.n_samples - self.n_train)
         # get indices of samples  to be used for training
         # 1) train_first True: choose first (1-test_frac) fraction of the data set points, if points arranged in time
         # 2) train_first False: choose (1-test_frac) fraction of data set at
         # random without replacement
-        if train_first:
-            # chose train fraction from first sims
-            self.train_indices = np.arange(self.n_samples)[:self.n_train]
-            self.test_indices = np.arange(self.n_samples)[self.n_train:]
-        else:
-            self.train_indices = np.random.choice(self.n_samples, self.n_train, replace=False)
-            self.train_indices = np.sort(self.train_indices)
-            self.test_indices = np.array(
-                [el for el in list(range(0, self.n_samples)) if el not in self.train_indices])
+        # 3) index specified: use the samples in index for training
+        if split is None:
+            split = DataSplit(self.n_samples, test_frac=test_frac, train_first=train_first,
+                              index=index)
+        self._set_split(split)
 
         # TODO: for GP and other models bad for extrapolation:
         #  add option to prioritize training samples at the border of presented parameter space
         print('Using  %d/%d samples to train the ML model' % (self.n_train, self.n_samples))
 
-        if index is not None:
-            self.n_train = len(index)
-            self.n_test = self.n_samples - self.n_train
-            self.train_indices = index
-            self.test_indices = np.array(
-                [el for el in list(range(0, self.n_samples)) if el not in self.train_indices])
-
-        X = {}
-        y = {}
-        if self.n_test > 0:
-            X_r = {}
-            y_r = {}
-        # use the entire row as a feature
-        if not local:
-            # list of features
-            X[0] = [X_i[self.train_indices] for X_i in feats]  # chose train fraction randomly
-            # the target data
-            y[0] = target[self.train_indices]
-            if self.n_test > 0:
-                X_r[0] = [X_i[self.test_indices] for X_i in feats]  # chose train fraction randomly
-                y_r[0] = target[self.test_indices]
-        # do not use entire row as feature, apply surrogate locally along second dimension
-        else:
-            # create a separate training set for every grid point
-            for i in range(self.n_points):
-                X[i] = [X_i[self.train_indices, i] for X_i in feats]
-                y[i] = target[self.train_indices].reshape([-1, 1])
+        # time-lagged training data
+        if lags is not None:
+            X_train, y_train, X_test, y_test = self._lazy_lag_training_data(feats, target, lags)
+            # materialize the lagged features unless specified otherwise
+            if not lazy:
+                X_train = X_train.to_array(dtype=dtype)
                 if self.n_test > 0:
-                    X_r[i] = [X_i[self.test_indices, i] for X_i in feats]
-                    y_r[i] = target[self.test_indices, i].reshape([-1, 1])
-
-        X_train = []
-        y_train = []
-
-        X_test = []
-        y_test = []
+                    X_test = X_test.to_array(dtype=dtype)
+                    print('done preparing data')
+            return X_train, y_train, X_test, y_test
 
         # No time-lagged training data
-        if lags is not None:
-            self.max_lag = np.max(list(chain(*lags)))
-            print('Creating time-lagged training data...')
-            # lag every training set in X and y
-            for i in range(len(X)):
-                X_train_i, y_train_i = self.lag_training_data(X[i], y[i], lags=lags)
-                X_train.append(X_train_i)
-                y_train.append(y_train_i)
-            if self.n_test > 0:
-                # lag testing set as well, so it correspond to new features generated during lagging
-                # NB: works only for train_first=True
-                for i in range(len(X_r)):
-                    X_test_i, y_test_i = self.lag_training_data(X_r[i], y_r[i], lags=lags)
-                    X_test.append(X_test_i)
-                    y_test.append(y_test_i)
-        else:
-            self.max_lag = 0
-            # no time lag, just add every entry in X and y to an array
-            # loop over all spatial points in the case of a local surrogate. For non-local
-            # surrogates, len(X) = 1
-            for i in range(len(X)):
-
-                # if only one unique feature vector is used
-                if len(X[i]) == 1:
-                    X_train.append(np.array(X[i]).reshape([self.n_train, -1]))
-                # if there are multiple feature vectors, concatenate them
-                else:
-                    #X_train.append(np.concatenate(X[i], axis=1))
-                    X_train.append(np.moveaxis(np.array(X[i]), 0, -1).reshape([self.n_train, -1]))
-
-                y_train.append(y[i])
-                # Testing data
-                if self.n_test > 0:
-                    # appends same feature values in a single nfeat-long array
-                    X_test.append(np.moveaxis(np.array(X_r[i]), 0, -1).reshape([self.n_test, -1]))
-                    y_test.append(y_r[i])
+        self.max_lag = 0
+        X_train, y_train = self._stack_training_data(feats, target, self.train_indices, dtype)
 
-        X_train = np.concatenate(X_train)
-        y_train = np.concatenate(y_train)
         # Testing and validation data
         if self.n_test > 0:
+            X_test, y_test = self._stack_training_data(feats, target, self.test_indices, dtype)
             if valid_frac > 0.0:
                 # validation fraction is extracted from original test fraction
                 # (valid_frac always has t0 be lesser than test_frac)
-                self.n_valid = (self.n_test + self.n_train) * valid_frac
-                X_valid = X_test[-self.n_valid:]
+                self.n_valid = int((self.n_test + self.n_train) * valid_frac)
+                self.X_valid = X_test[-self.n_valid:]
+                self.y_valid = y_test[-self.n_valid:]
                 X_test = X_test[:-self.n_valid]
-                y_valid = y_test[-self.n_valid:]
                 y_test = y_test[:-self.n_valid]
-                X_valid = np.concatenate(X_valid)
-                y_valid = np.concatenate(y_valid)
-
-            X_test = np.concatenate(X_test)
-            y_test = np.concatenate(y_test)
             print('done preparing data')
         else:
-            X_test = np.empty((0, X_train.shape[1]))
+            X_test = np.empty((0, X_train.shape[1]), dtype=X_train.dtype)
             y_test = np.empty((0, y_train.shape[1]))
 
         return X_train, y_train, X_test, y_test
 
-    def get_online_training_data(self, **kwargs):
+    def _set_split(self, split):
+        """
+        Set the train / test split of the data.
+
+        Parameters
+        ----------
+        split : DataSplit
+            The split.
+
+        Returns
+        -------
+        None.
+
+        """
+        assert split.n_samples == self.n_samples, \
+            "The split contains %d samples, the data %d" % (split.n_samples, self.n_samples)
+        self.split = split
+        self.n_train = split.n_train
+        self.n_test = split.n_test
+        self.train_indices = split.train_indices
+        self.test_indices = split.test_indices
+
+    def _get_cached_training_data(self, cache, feats, target, **kwargs):
         """
-        Return the training data for a single online-learning step.
+        Return the prepared training data from the cache, or prepare it with
+        get_training_data and store it in the cache.
+
+        Parameters
+        ----------
+        cache : TrainingDataCache
+            The cache.
+        feats : list of arrays
+            The feature arrays.
+        target : array
+            The target data.
+        **kwargs : the keyword arguments of get_training_data.
+
+        Returns
+        -------
+        X_train, y_train, X_test, y_test
+
+        """
+        params = dict(kwargs)
+        if params['split'] is not None:
+            params['split'] = params['split'].train_indices
+        if params['index'] is not None:
+            params['index'] = np.asarray(params['index'])
+        if params['stencil'] is not None:
+            params['stencil'] = repr(params['stencil'])
+        key = cache.key(feats + [target], **params)
+
+        data = cache.load(key)
+        if data is None:
+            X_train, y_train, X_test, y_test = self.get_training_data(feats, target, **kwargs)
+            data = {'X_train': X_train, 'y_train': y_train, 'X_test': X_test, 'y_test': y_test,
+                    'train_indices': self.train_indices}
+            if kwargs['valid_frac'] > 0.0 and self.n_test > 0:
+                data['X_valid'] = self.X_valid
+                data['y_valid'] = self.y_valid
+            cache.store(key, data)
+            return X_train, y_train, X_test, y_test
+
+        print('Loaded training data from cache %s' % key)
+
+        # restore the state that get_training_data would have set
+        self.n_feat_arrays = len(feats)
+        self.local = kwargs['local']
+        self.stencil = kwargs['stencil']
+        self.n_samples = feats[0].shape[0]
+        self.n_points = feats[0].shape[1]
+        self._set_split(DataSplit(self.n_samples, index=np.array(data['train_indices'])))
+        print('Using  %d/%d samples to train the ML model' % (self.n_train, self.n_samples))
+        if 'X_valid' in data:
+            self.X_valid = data['X_valid']
+            self.y_valid = data['y_valid']
+            self.n_valid = self.X_valid.shape[0]
+
+        lags = kwargs['lags']
+        if lags is not None:
+            self.max_lag = np.max(list(chain(*lags)))
+            self.empty_feature_history(lags)
+        else:
+            self.max_lag = 0
+
+        return data['X_train'], data['y_train'], data['X_test'], data['y_test']
+
+    def _stack_training_data(self, feats, target, indices, dtype=None):
+        """
+        Gather the (not time-lagged) feature vectors and targets of the given samples.
+
+        Parameters
+        ----------
+        feats : list of arrays
+            The feature arrays, each of shape (n_samples, n_points_i).
+        target : array
+            The target data, of shape (n_samples, n_target).
+        indices : array of int
+            The indices of the samples.
+        dtype : data type, optional
+            The data type of X. The default is None, meaning the data type of the feats.
+
+        Returns
+        -------
+        X, y (arrays). In the case of a local surrogate, the rows contain the features
+        of grid point 0 at all samples, then those of grid point 1, etc.
+
+        """
+        # a view of the data if the indices are contiguous, such that the features are
+        # converted to dtype while they are copied into X
+        rows = _as_slice(indices)
+        n_indices = len(indices)
+        if dtype is None:
+            dtype = np.result_type(*feats)
+
+        if self.local and getattr(self, 'stencil', None) is None:
+            # array of shape (n_points, n_indices, n_feats)
+            X = np.empty([feats[0].shape[1], n_indices, len(feats)], dtype=dtype)
+            for i, X_i in enumerate(feats):
+                X[:, :, i] = X_i[rows].T
+            X = X.reshape([-1, len(feats)])
+            y = target[indices].T.reshape([-1, 1])
+        elif self.local:
+            # array of shape (n_indices, n_points, n_in), gathered per feature
+            X = np.concatenate([self._neighbourhood(X_i[rows], i).astype(dtype, copy=False)
+                                for i, X_i in enumerate(feats)], axis=2)
+            X = np.swapaxes(X, 0, 1).reshape([-1, X.shape[2]])
+            y = target[indices].T.reshape([-1, 1])
+        else:
+            # concatenate all features of a sample, as in _predict
+            sizes = [int(np.prod(X_i.shape[1:])) for X_i in feats]
+            X = np.empty([n_indices, np.sum(sizes, dtype=int)], dtype=dtype)
+            col = 0
+            for X_i, size in zip(feats, sizes):
+                X[:, col:col + size] = X_i[rows].reshape([n_indices, size])
+                col += size
+            y = target[indices]
+
+        return X, y
+
+    def get_chunked_training_data(self, feats, target, local=False, test_frac=0.0,
+                                  chunk_size=10**4, batches_per_chunk=None):
+        """
+        Generate out-of-core training data, which is read from disk in chunks of
+        consecutive samples during training. Only a single chunk of the training data is
+        kept in memory at any time.
+
+        Parameters
+        ----------
+        feats : array-like or list of array-likes
+            A single on-disk feature array or a list of different feature arrays, e.g.
+            h5py datasets obtained from Campaign.load_hdf5_data(in_memory=False). The shape
+            of the feature arrays must be (n_samples, n_points_i).
+        target : array-like
+            The on-disk target array, of shape (n_samples, n_target).
+        local : boolean, optional
+            Apply the surrogate locally at every grid point, see get_training_data.
+            The default is False.
+        test_frac : float, optional
+            The final fraction of the samples that is withheld from training.
+            The default is 0.0, and it must be in [0.0, 1.0].
+        chunk_size : int, optional
+            The number of samples that is read from disk at once. The default is 10**4.
+        batches_per_chunk : int, optional
+            The number of mini batches drawn from a chunk before another chunk is read.
+            The default is None, see ChunkedDataset.
+
+        Returns
+        -------
+        X_train, y_train, X_test, y_test (ChunkedDataset objects).
+
+        """
+
+        if not isinstance(feats, list):
+            feats = [feats]
+
+        self.n_feat_arrays = len(feats)
+        self.local = local
+        self.stencil = None
+        self.max_lag = 0
+
+        self.n_samples = feats[0].shape[0]
+        self.n_points = feats[0].shape[1]
+
+        # the training data are the first samples, such that chunks are contiguous on disk
+        self._set_split(DataSplit(self.n_samples, test_frac=test_frac, train_first=True))
+
+        print('Using  %d/%d samples to train the ML model' % (self.n_train, self.n_samples))
+
+        kwargs = {'chunk_size': chunk_size, 'local': local,
+                  'batches_per_chunk': batches_per_chunk}
+        X_train = ChunkedDataset(feats, stop=self.n_train, **kwargs)
+        y_train = ChunkedDataset([target], stop=self.n_train, **kwargs)
+        X_test = ChunkedDataset(feats, start=self.n_train, **kwargs)
+        y_test = ChunkedDataset([target], start=self.n_train, **kwargs)
+
+        return X_train, y_train, X_test, y_test
+
+    def get_online_training_data(self, n_samples=None, prioritized=False, **kwargs):
+        """
+        Return the training data for a single online-learning step. The replay buffer
+        slots of every returned row are stored in self.online_slots, such that the
+        priorities can be updated afterwards.
+
+        Parameters
+        ----------
+        n_samples : int, optional
+            If specified, only use a mini batch of n_samples (time) samples drawn from the
+            online replay buffer. The default is None, in which case the entire window
+            of online training data is used.
+        prioritized : boolean, optional
+            Draw the n_samples samples with probabilities based on their priorities, see
+            ReplayBuffer.sample. The default is False.
 
         Returns
         -------
@@ -374,23 +1056,29 @@ class Feature_Engineering:
 
         """
 
-        feats = self.online_feats
-        target = np.array(self.online_target)
+        if n_samples is not None:
+            return self._sample_online_training_data(n_samples, prioritized, **kwargs)
+
+        feats, target = self.online_buffer.get_window()
+        chrono_slots = self.online_buffer.chronological_slots()
 
         # if lagged feature vectors are used
         if self.lags is not None:
 
-            feats = [np.array(feat) for feat in feats]
+            # the first max_lag samples of the window are only used as lagged features
+            window_slots = chrono_slots[self.max_lag:]
+
             if not self.local:
                 # create (time-lagged) training data from X
                 X_train, y_train = self.lag_training_data(feats, target, lags=self.lags,
                                                           init_feats=False)
+                self.online_slots = window_slots
             else:
                 X_train = []
                 y_train = []
                 # create a separate training set for every grid point
                 for i in range(self.n_points):
-                    X_i = [X_i[:, i] for X_i in feats]
+                    X_i = [self._neighbourhood(X_j, j)[:, i] for j, X_j in enumerate(feats)]
                     y_i = target[:, i].reshape([-1, 1])
                     # create time-lagged data per gridpoint
                     X_train_i, y_train_i = self.lag_training_data(X_i, y_i, lags=self.lags,
@@ -399,6 +1087,8 @@ class Feature_Engineering:
                     y_train.append(y_train_i)
                 X_train = np.concatenate(X_train)
                 y_train = np.concatenate(y_train)
+                # the rows are ordered per grid point
+                self.online_slots = np.tile(window_slots, self.n_points)
 
         # do not time lag data
         else:
@@ -407,9 +1097,127 @@ class Feature_Engineering:
             X_train = np.concatenate(feats, axis=1)
             X_train = X_train.reshape([-1, kwargs['n_in']])
             y_train = target.reshape([-1, kwargs['n_out']])
+            # the rows are ordered per time sample
+            self.online_slots = np.repeat(chrono_slots, y_train.shape[0] // chrono_slots.size)
+
+        return X_train, y_train
+
+    def _sample_online_training_data(self, n_samples, prioritized, **kwargs):
+        """
+        Draw a mini batch of (time-lagged) online training data directly from the
+        replay buffer, without building the training data of the entire window.
+        The buffer slots of every returned row are stored in self.online_slots, such
+        that the priorities can be updated afterwards.
+
+        Parameters
+        ----------
+        n_samples : int
+            The number of (time) samples to draw.
+        prioritized : boolean
+            Draw samples with probabilities based on their priorities.
+
+        Returns
+        -------
+        X_train : array
+            The feature array.
+        y_train : array
+            The target array.
+
+        """
+        max_lag = self.max_lag if self.lags is not None else 0
+        # chronological positions of the samples, leaving room for the time lags
+        pos = self.online_buffer.sample(n_samples, prioritized=prioritized, start=max_lag)
+
+        return self._gather_online_training_data(pos)
+
+    def get_latest_online_training_data(self):
+        """
+        Return the (time-lagged) training rows of the most recent online sample only.
+
+        Returns
+        -------
+        X_train : array or None
+            The feature array. None if the buffer does not contain enough samples
+            to create the time-lagged features.
+        y_train : array or None
+            The target array.
+
+        """
+        max_lag = self.max_lag if self.lags is not None else 0
+        if len(self.online_buffer) <= max_lag:
+            return None, None
+
+        return self._gather_online_training_data(np.array([len(self.online_buffer) - 1]))
+
+    def _gather_online_training_data(self, pos):
+        """
+        Gather the (time-lagged) online training rows of the samples at the chronological
+        positions pos of the replay buffer.
+
+        Parameters
+        ----------
+        pos : array of int
+            The chronological positions, where 0 is the oldest sample in the buffer.
+
+        Returns
+        -------
+        X_train : array
+            The feature array.
+        y_train : array
+            The target array.
+
+        """
+        buffer = self.online_buffer
+        chrono_slots = buffer.chronological_slots()
+        slots = chrono_slots[pos]
+
+        # gather the lagged features, same ordering as in lag_training_data
+        C = []
+        for i in range(self.n_feat_arrays):
+            lags_i = self.lags[i] if self.lags is not None else [0]
+            for lag in np.sort(lags_i)[::-1]:
+                C_i = buffer.feats[i][chrono_slots[pos - lag]]
+                if self.local:
+                    # array of shape (n_samples, n_points, n_offsets_i)
+                    C_i = self._neighbourhood(C_i.reshape([pos.size, -1]), i)
+                C.append(C_i)
+        target = buffer.target[slots]
+
+        if not self.local:
+            X_train = np.concatenate([C_i.reshape([pos.size, -1]) for C_i in C], axis=1)
+            y_train = target.reshape([pos.size, -1])
+            self.online_slots = slots
+        else:
+            # one row per (time sample, grid point)
+            X_train = np.concatenate(C, axis=-1)
+            X_train = X_train.reshape([-1, X_train.shape[-1]])
+            y_train = target.reshape([-1, 1])
+            self.online_slots = np.repeat(slots, self.n_points)
 
         return X_train, y_train
 
+    def store_online_training_data(self, feats, target):
+        """
+        Store the features and target of a single online training step in the replay
+        buffer. The oldest sample is overwritten once window_length samples are stored.
+
+        Parameters
+        ----------
+        feats : array or list of arrays
+            The input features.
+        target : array
+            The target data.
+
+        Returns
+        -------
+        None.
+
+        """
+        if isinstance(feats, np.ndarray):
+            feats = [feats]
+
+        self.online_buffer.append(feats[0:self.n_feat_arrays], target)
+
     def generate_online_training_data(self, feats, LR_before, LR_after, HR_before, HR_after):
         """
         Compute the features and the target data for an online training step. Results are
@@ -439,15 +1247,6 @@ class Feature_Engineering:
 
         """
 
-        # multiple faetures arrays are stored in a list. For consistency put a single
-        # array also in a list.
-        if isinstance(feats, np.ndarray):
-            feats = [feats]
-
-        # store input features
-        for i in range(self.n_feat_arrays):
-            self.online_feats[i].append(feats[i])
-
         # difference of the low res model between time n and time n+1
         delta_LR = LR_after - LR_before
         # the difference between the low res and high res model at time n
@@ -463,14 +1262,8 @@ class Feature_Engineering:
         correction = delta_no_nudge_HR - delta_LR
 
         # make the correction the target for the neural network. Divide by timestep
-        # since update is LR += correction * dt
-        self.online_target.append(correction / self.dt_LR)
-
-        # remove oldest item from the online features is the window lendth is exceeded
-        if len(self.online_feats[0]) > self.window_length:
-            for i in range(self.n_feat_arrays):
-                self.online_feats[i].pop(0)
-            self.online_target.pop(0)
+        # since update is LR += correction * dt. Store together with the input features.
+        self.store_online_training_data(feats, correction / self.dt_LR)
 
     def set_online_training_parameters(self, tau_nudge, dt_LR, window_length):
         """
@@ -493,6 +1286,8 @@ class Feature_Engineering:
         self.tau_nudge = tau_nudge
         self.dt_LR = dt_LR
         self.window_length = window_length
+        # fixed-capacity storage of the online features and target data
+        self.online_buffer = ReplayBuffer(window_length)
 
     def lag_training_data(self, X, y, lags, init_feats=True):
         """
@@ -562,23 +1357,63 @@ class Feature_Engineering:
             idx += 1
 
         # C is a list of lagged features, turn into a single array X_train
-        X_train = C[0]
+        X_train = np.concatenate([X_i.reshape([y_train.shape[0], -1]) for X_i in C], axis=1)
 
-        if X_train.ndim == 1:
-            X_train = X_train.reshape([y_train.shape[0], 1])
+        # initialize the storage of features
+        if init_feats:
+            self.empty_feature_history(lags)
 
-        for X_i in C[1:]:
+        return X_train, y_train
+
+    def _lazy_lag_training_data(self, feats, target, lags):
+        """
+        Create time-lagged training and test data without materializing the lagged
+        feature matrices. The rows and columns are ordered as in get_training_data.
+
+        Parameters
+        ----------
+        feats : list of arrays
+            The feature arrays, each of shape (n_samples, n_points_i).
+        target : array
+            The target data, of shape (n_samples, n_target).
+        lags : list of lists
+            The time lags of each feature.
 
-            if X_i.ndim == 1:
-                X_i = X_i.reshape([y_train.shape[0], 1])
+        Returns
+        -------
+        X_train, y_train, X_test, y_test, where X_train and X_test are LaggedDataset objects.
+
+        """
+        self.max_lag = np.max(list(chain(*lags)))
+        print('Creating time-lagged training data...')
+
+        def lagged_target(y):
+            y = y[self.max_lag:]
+            # local surrogate: one column per grid point, stacked point by point
+            if self.local:
+                y = y.T.reshape([-1, 1])
+            # a copy, y can be a view of the target data
+            return np.array(y)
+
+        rows = _as_slice(self.train_indices)
+        X_train = LaggedDataset([X_i[rows] for X_i in feats], lags, local=self.local,
+                                stencil=self.stencil)
+        y_train = lagged_target(target[rows])
 
-            X_train = np.append(X_train, X_i, axis=1)
+        if self.n_test > 0:
+            # NB: works only for train_first=True
+            rows = _as_slice(self.test_indices)
+            X_test = LaggedDataset([X_i[rows] for X_i in feats], lags, local=self.local,
+                                   stencil=self.stencil)
+            y_test = lagged_target(target[rows])
+        else:
+            X_test = np.empty((0, X_train.shape[1]))
+            y_test = np.empty((0, y_train.shape[1]))
 
         # initialize the storage of features
-        if init_feats:
-            self.empty_feature_history(lags)
+        self.empty_feature_history(lags)
 
-        return X_train, y_train
+        return X_train, y_train, X_test, y_test
 
     def bin_data(self, y, n_bins):
         """
@@ -593,7 +1428,9 @@ class Feature_Engineering:
 
         Returns
         -------
-        None.
+        y_idx_binned: array
+            size (number of samples, n_bins * number of variables): the one-hot encoded
+            bin indices of every variable.
 
         """
 
@@ -605,40 +1442,55 @@ class Feature_Engineering:
             n_vars = 1
             y = y.reshape([n_samples, 1])
 
-        self.binnumbers = np.zeros([n_samples, n_vars]).astype('int')
-        self.y_binned = {}
-        self.y_binned_mean = {}
-        y_idx_binned = np.zeros([n_samples, n_bins * n_vars])
-        self.bins = {}
         self.n_vars = n_vars
-
-        for i in range(n_vars):
-
-            self.y_binned[i] = {}
-            self.y_binned_mean[i] = {}
-
-            bins = np.linspace(np.min(y[:, i]), np.max(y[:, i]), n_bins + 1)
-            self.bins[i] = bins
-
-            _, _, self.binnumbers[:, i] = \
-                stats.binned_statistic(y[:, i], np.zeros(n_samples), statistic='count', bins=bins)
-
-            unique_binnumbers = np.unique(self.binnumbers[:, i])
-
-            offset = i * n_bins
-
-            for j in unique_binnumbers:
-                idx = np.where(self.binnumbers[:, i] == j)
-                self.y_binned[i][j - 1] = y[idx, i]
-                self.y_binned_mean[i][j - 1] = np.mean(y[idx, i])
-                y_idx_binned[idx, offset + j - 1] = 1.0
+        self.n_bins = n_bins
+
+        # equidistant bin edges of all variables, shape (n_bins + 1, n_vars)
+        y_min = np.min(y, axis=0)
+        y_max = np.max(y, axis=0)
+        edges = np.linspace(y_min, y_max, n_bins + 1)
+        self.bins = {i: edges[:, i] for i in range(n_vars)}
+
+        # assign all samples to bins at once. The last bin includes the right edge.
+        width = (y_max - y_min) / n_bins
+        width[width == 0.0] = 1.0
+        bin_idx = np.clip(np.floor((y - y_min) / width).astype('int'), 0, n_bins - 1)
+        # correct for round-off errors with respect to the actual bin edges
+        cols = np.arange(n_vars)
+        bin_idx -= (y < edges[bin_idx, cols]) & (bin_idx > 0)
+        bin_idx += (y >= edges[bin_idx + 1, cols]) & (bin_idx < n_bins - 1)
+        # bin numbers >= 1, as in scipy.stats.binned_statistic
+        self.binnumbers = bin_idx + 1
+
+        # store the binned data CSR-style: the samples of bin j of variable i are
+        # binned_data[bin_offsets[i * n_bins + j]:bin_offsets[i * n_bins + j + 1]]
+        keys = (bin_idx + cols * n_bins).T.flatten()
+        # a stable sort of small integers is a radix sort, which is O(n_samples * n_vars)
+        if n_vars * n_bins <= np.iinfo(np.uint16).max:
+            order = np.argsort(keys.astype(np.uint16), kind='stable')
+        else:
+            order = np.argsort(keys, kind='stable')
+        self.binned_data = y.T.flatten()[order]
+        counts = np.bincount(keys, minlength=n_vars * n_bins)
+        self.bin_offsets = np.concatenate([[0], np.cumsum(counts)])
+        # the bin means, nan for empty bins
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.bin_means = (np.bincount(keys, weights=y.T.flatten(), minlength=n_vars * n_bins)
+                              / counts).reshape([n_vars, n_bins])
+
+        # one-hot encoded bin indices
+        y_idx_binned = np.zeros([n_samples, n_bins * n_vars])
+        rows = np.arange(n_samples).reshape([-1, 1]) * (n_bins * n_vars)
+        y_idx_binned.reshape(-1)[rows + bin_idx + cols * n_bins] = 1.0
 
         return y_idx_binned
 
-    def empty_feature_history(self, lags):
+    def empty_feature_history(self, lags, n_members=None):
         """
-        Initialize an empty feat_history dict. This dict keeps track of the features
-        arrays that were used up until 'max_lag + 1' steps ago.
+        Initialize an empty feature history. The history keeps track of the features
+        arrays that were used up until 'max_lag + 1' steps ago. It is stored in a
+        preallocated circular array, which is allocated when the first features are
+        appended.
 
         Parameters:
 
@@ -646,7 +1498,11 @@ class Feature_Engineering:
                   Example: if X=[X_1, X_2] and lags = [[1], [1, 2]], the first
                   feature array X_1 is lagged by 1 (time) step and the second
                   by 1 and 2 (time) steps.
+            n_members: the number of ensemble members, if the history is used to
+                  follow an ensemble of trajectories. The default is None, meaning a
+                  single trajectory.
         """
+        self.n_members = n_members
         self.lags = []
 
         for l in lags:
@@ -654,15 +1510,71 @@ class Feature_Engineering:
 
         # self.max_lag = np.max(list(chain(*lags)))
 
-        self.feat_history = {}
-
         # the number of feature arrays that make up the total input feature vector
         # self.n_feat_arrays = len(lags)
 
+        self.feat_history = None
+        # the total number of appended feature arrays
+        self.history_count = 0
+
+    def _init_history_buffer(self, X):
+        """
+        Allocate the circular feature history array, and precompute the gather indices
+        of the time-lagged feature vector.
+
+        The history is stored in an array of shape (2 * (max_lag + 1), n_members * n_total),
+        where n_total is the combined size of all feature arrays of a single trajectory.
+        Every new set of features is written to two rows, (count % L) and (count % L) + L,
+        with L = max_lag + 1. The last L steps are then always available in L consecutive
+        rows, such that the lagged feature vector is obtained by adding a single offset
+        to precomputed flat indices.
+
+        Parameters
+        ----------
+        X : list of arrays
+            The feature arrays of a single (time) step. In the case of an ensemble, the
+            arrays have a leading dimension of size n_members.
+
+        Returns
+        -------
+        None.
+
+        """
+        L = self.max_lag + 1
+        n_members = 1 if self.n_members is None else self.n_members
+        # the features of a single trajectory
+        if self.n_members is not None:
+            X = [X_i[0] for X_i in X]
+        sizes = [X_i.size for X_i in X]
+        col_start = np.cumsum([0] + sizes)
+        self.history_n_total = col_start[-1]
+        self.history_row_size = n_members * self.history_n_total
+        self.feat_history = np.zeros([2 * L, self.history_row_size])
+
+        # flat indices of the lagged features, relative to the row of the current step
+        # (row L). Local features (2D with more than 1 column) contribute one entry per
+        # stencil offset, to which the index of the (neighbouring) point must be added.
+        local = [X_i.ndim == 2 and X_i.shape[1] != 1 for X_i in X]
+        n_points = max([size for size, local_i in zip(sizes, local) if local_i], default=1)
+        offsets = []
+        # the point indices of every entry, one row per local point
+        point_idx = []
         for i in range(self.n_feat_arrays):
-            self.feat_history[i] = []
+            if local[i]:
+                neighbours = self._neighbourhood(np.arange(sizes[i]), i)
+            for lag in self.lags[i]:
+                begin = (L - lag) * self.history_row_size + col_start[i]
+                if local[i]:
+                    offsets.extend([begin] * neighbours.shape[1])
+                    point_idx.append(neighbours)
+                else:
+                    offsets.extend(range(begin, begin + sizes[i]))
+                    point_idx.append(np.zeros([n_points, sizes[i]], dtype=int))
 
-    def initial_condition_feature_history(self, feats, start=0):
+        self.history_offsets = np.array(offsets)
+        self.history_point_idx = np.concatenate(point_idx, axis=1)
+
+    def initial_condition_feature_history(self, feats, start=0, ensemble=False):
         """
         The features can be lagged in time. Therefore, the initial condition of the
         time-lagged feature vector must be set up. The training data is used
@@ -676,13 +1588,25 @@ class Feature_Engineering:
 
         + start : the starting index of the training features. Default is 0.
 
+        + ensemble : if True, each var_i has a leading ensemble dimension, such that
+        var_i[:, 0] gives the value of var_i of all ensemble members at t_0, etc. The
+        history is then emptied and follows all members, and _predict expects features
+        with a leading dimension of size n_members. Default is False.
+
         Returns
         -------
         None.
 
         """
+        if ensemble:
+            self.empty_feature_history(self.lags, n_members=feats[0].shape[0])
+
         for i in range(self.max_lag):
-            if not self.local:
+            if ensemble and not self.local:
+                feat = [X_i[:, start + i] for X_i in feats]
+            elif ensemble:
+                feat = [X_i[:, start + i].reshape([X_i.shape[0], 1, -1]) for X_i in feats]
+            elif not self.local:
                 feat = [X_i[start + i] for X_i in feats]
             else:
                 feat = [X_i[start + i].reshape([1, -1]) for X_i in feats]
@@ -691,12 +1615,13 @@ class Feature_Engineering:
 
     def append_feat(self, X):
         """
-        Append the feature vectors in X to feat_history dict
+        Append the feature vectors in X to the circular feat_history array
 
         Parameters:
 
             X: features. Either an array of dimension (n_samples, n_features)
-               or a list of arrays of dimension (n_samples, n_features)
+               or a list of arrays of dimension (n_samples, n_features). In the case
+               of an ensemble, the arrays have a leading dimension of size n_members.
 
         """
 
@@ -704,41 +1629,63 @@ class Feature_Engineering:
         if isinstance(X, np.ndarray):
             X = [X]
 
-        for i in range(self.n_feat_arrays):
+        # convert a feature history stored as a dict of lists by an older version
+        if isinstance(self.feat_history, dict):
+            old_history = self.feat_history
+            self.empty_feature_history(self.lags)
+            for j in range(len(old_history[0])):
+                self.append_feat([old_history[i][j] for i in range(self.n_feat_arrays)])
 
-            assert isinstance(
-                X[i], np.ndarray), 'ERROR: Only numpy arrays are allowed as input features.'
-
-            self.feat_history[i].append(X[i])
+        shapes = [np.shape(X_i) for X_i in X[0:self.n_feat_arrays]]
+        if self.feat_history is None or self.history_shapes != shapes:
+            for i in range(self.n_feat_arrays):
+                assert isinstance(
+                    X[i], np.ndarray), 'ERROR: Only numpy arrays are allowed as input features.'
+            self._init_history_buffer(X[0:self.n_feat_arrays])
+            self.history_shapes = shapes
+
+        L = self.max_lag + 1
+        row = self.history_count % L
+        n_members = 1 if self.n_members is None else self.n_members
+        # views of the two rows, with one row per ensemble member
+        rows = [self.feat_history[row].reshape([n_members, -1]),
+                self.feat_history[row + L].reshape([n_members, -1])]
+        col = 0
+        for i in range(self.n_feat_arrays):
+            X_i = X[i].reshape([n_members, -1])
+            size = X_i.shape[1]
+            # store the features twice, such that the last L steps are contiguous
+            for row_view in rows:
+                row_view[:, col:col + size] = X_i
+            col += size
 
-            # if max number of features is reached, remove first item
-            if len(self.feat_history[i]) > self.max_lag + 1:
-                self.feat_history[i].pop(0)
+        self.history_count += 1
 
     def get_feat_history(self, **kwargs):
         """
-        Return the features from the feat_history dict based on the lags
+        Return the features from the feat_history array based on the lags
         specified in self.lags
 
+        Parameters:
+            index: int or array of int (optional). The index of the local point(s). If
+                   an array of indices is given, one lagged feature vector per point is
+                   returned.
+
         Returns:
-            X_i: array of lagged features of dimension (feat1.size + feat2.size + ...,)
+            X_i: array of lagged features of dimension (feat1.size + feat2.size + ...,),
+                 or (index.size, feat1.size + feat2.size + ...) for an array of indices.
+                 In the case of an ensemble, the array has an additional leading
+                 dimension of size n_members.
         """
-        X_i = []
-
-        idx = 0
-        for i in range(self.n_feat_arrays):
-            for lag in self.lags[idx]:
-                begin = self.max_lag - lag
-                current_feat = self.feat_history[i][begin]
-                if current_feat.ndim == 1:
-                    X_i.append(current_feat)
-                elif current_feat.shape[1] == 1:
-                    X_i.append(current_feat.flatten())
-                else:
-                    X_i.append(np.array([current_feat[0][kwargs['index']]]))
-            idx += 1
+        # the row of the most recent features is row + L
+        row = (self.history_count - 1) % (self.max_lag + 1)
+        idx = self.history_offsets + row * self.history_row_size
+        if 'index' in kwargs:
+            idx = idx + self.history_point_idx[kwargs['index']]
+        if self.n_members is not None:
+            idx = np.add.outer(np.arange(self.n_members) * self.history_n_total, idx)
 
-        return np.array(list(chain(*X_i)))
+        return np.take(self.feat_history, idx)
 
     # def standardize_data(self, standardize_X=True, standardize_y=True):
     #     """
@@ -811,3 +1758,71 @@ class Feature_Engineering:
 
     #         print(len(lags_n))
     #         print(np.where(test > 20)[0].size)
+
+
+def _acquisition_with_gradient(acquisition_function, x, bounds=None):
+    """
+    Evaluate a vectorized acquisition function and its finite difference gradient
+    with a single call. The steps point into the bounds, i.e. a backward difference
+    is used where a forward step would leave the box.
+
+    Parameters
+    ----------
+    acquisition_function : callable
+        Acquisition function that accepts an array of shape (n_samples, n_in).
+    x : array
+        A single sample of shape (n_in,).
+    bounds : array, optional
+        The lower and upper bounds of every input, of shape (n_in, 2). The default is None.
+
+    Returns
+    -------
+    float, array
+        The value of the acquisition function and its gradient at x.
+
+    """
+    h = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(x))
+    if bounds is not None:
+        h = np.where(x + h > bounds[:, 1], -h, h)
+    X = np.concatenate([x.reshape([1, -1]), x + np.diag(h)])
+    f = np.array(acquisition_function(X)).flatten()
+    return f[0], (f[1:] - f[0]) / h
+
+
+def _minimize_from_starts(fun, starts, jac=None, bounds=None):
+    """
+    Run a bounded local minimization from every starting point.
+
+    Parameters
+    ----------
+    fun : callable
+        The function to minimize.
+    starts : array
+        The starting points, of shape (n_starts, n_in).
+    jac : callable or boolean, optional
+        The gradient, see scipy.optimize.minimize. The default is None.
+    bounds : array, optional
+        The lower and upper bounds of every input, of shape (n_in, 2). The default is None.
+
+    Returns
+    -------
+    list
+        The local optima and their function values, as (x, fun) tuples.
+
+    """
+    results = []
+    for x0 in starts:
+        result = minimize(fun, x0, jac=jac, bounds=bounds, method='L-BFGS-B')
+        results.append((result.x, float(result.fun)))
+    return results
+
+
+def _as_slice(indices):
+    """
+    Return a slice if the indices are contiguous, such that indexing gives a view of
+    the data instead of a copy. Otherwise the indices are returned.
+    """
+    if len(indices) > 0 and np.array_equal(indices, np.arange(indices[0],
+                                                              indices[0] + len(indices))):
+        return slice(indices[0], indices[0] + len(indices))
+    return indices
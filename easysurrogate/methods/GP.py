@@ -103,6 +103,10 @@ class GP:
 
         self.n_train = X.shape[0]
 
+        # the training data, used to condition the GP on new observations
+        self.X = X
+        self.y = y
+
         try:
             n_in = X.shape[1]
             if self.n_in != n_in:
@@ -135,11 +139,44 @@ class GP:
                                               nugget=self.noize_argument)
             self.instance = mogp.fit_GP_MAP(self.instance)
 
+    def condition(self, X_new, y_new):
+        """
+        Add new observations to the training data without re-optimizing the kernel
+        hyperparameters, e.g. to add pending points with their predicted mean
+        (kriging believer) during batch selection.
+
+        Parameters
+        ----------
+        X_new : array
+            The new inputs, of shape (n_new, n_in).
+        y_new : array
+            The new outputs, of shape (n_new, n_out).
+
+        Returns
+        -------
+        None.
+
+        """
+        X = np.concatenate([self.X, X_new.reshape([-1, self.n_in])])
+        y = np.concatenate([self.y, y_new.reshape([-1, self.n_out])])
+
+        if self.backend == 'scikit-learn':
+            # the kernel hyperparameters of the trained GP are kept fixed
+            self.instance = GaussianProcessRegressor(kernel=self.kernel, optimizer=None,
+                                                     normalize_y=True)
+            self.instance.fit(X, y)
+        else:
+            raise NotImplementedError('Conditioning is only implemented for scikit-learn backend')
+
+        self.X = X
+        self.y = y
+        self.n_train = X.shape[0]
+
     def predict(self, X_i):
 
         if self.backend == 'scikit-learn':
-            # for single sample X_i should be nparray(1, n_feat)
-            m, v = self.instance.predict(X_i.reshape(1, -1), return_std=True)
+            # X_i is a single sample or an array of samples of shape (n_samples, n_feat)
+            m, v = self.instance.predict(X_i.reshape(-1, self.n_in), return_std=True)
             d = np.zeros(m.shape)
         elif self.backend == 'mogp':
             m, v, d = self.instance.predict(X_i, unc=True, deriv=True)
@@ -0,0 +1,118 @@
+"""
+Class for the importance sampling of mini batches.
+"""
+
+import numpy as np
+
+
+class ImportanceSampler:
+    """
+    Weighted sampler of the mini batches of a neural network. Training sample i is
+    drawn with probability p_i = (1 - uniform_frac) * w_i / sum(w) + uniform_frac / n,
+    where w_i >= 0 is its weight. The loss gradient of every drawn sample is multiplied
+    by its importance weight 1 / (n * p_i), such that the mini-batch gradient remains
+    an unbiased estimate of the gradient of the mean loss over all n samples. With
+    weights that are large in the tails of a heavy-tailed target, e.g. the inverse
+    density of the binned target (Feature_Engineering.inverse_density_weights), the
+    rare extreme samples are visited far more often than with uniform sampling.
+
+    If adaptive is True, the weights of the drawn samples are set to their current loss
+    values after every mini batch.
+    """
+
+    def __init__(self, weights, uniform_frac=0.1, adaptive=False):
+        """
+        Create an ImportanceSampler object.
+
+        Parameters
+        ----------
+        weights : array
+            The non-negative weight of every training sample, of shape (n_train,).
+        uniform_frac : float, optional
+            Fraction of the uniform distribution in the sampling probabilities. This
+            bounds the importance weights by 1 / uniform_frac, and ensures that every
+            sample can be drawn. The default is 0.1.
+        adaptive : boolean, optional
+            Replace the weights of the drawn samples by their loss values after every
+            mini batch, see update. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        assert 0.0 < uniform_frac <= 1.0, "uniform_frac must be in (0.0, 1.0]"
+
+        self.weights = np.array(weights, dtype=float).flatten()
+        assert np.all(self.weights >= 0.0), "The weights must be non-negative"
+        self.n_samples = self.weights.size
+        self.uniform_frac = uniform_frac
+        self.adaptive = adaptive
+        # the cumulative sampling probabilities, recomputed after the weights change
+        self._cdf = None
+
+    def probabilities(self):
+        """
+        The sampling probabilities of all training samples.
+
+        Returns
+        -------
+        array
+            The probabilities, of shape (n_train,).
+
+        """
+        total = np.sum(self.weights)
+        probs = np.full(self.n_samples, 1.0 / self.n_samples)
+        if total > 0.0:
+            probs *= self.uniform_frac
+            probs += (1.0 - self.uniform_frac) * self.weights / total
+        return probs
+
+    def sample(self, n_samples):
+        """
+        Draw a mini batch, with replacement.
+
+        Parameters
+        ----------
+        n_samples : int
+            The size of the mini batch.
+
+        Returns
+        -------
+        idx : array
+            The indices of the drawn samples, of shape (n_samples,).
+        importance_weights : array
+            The factors 1 / (n_train * p_i) of the loss of the drawn samples.
+
+        """
+        if self._cdf is None:
+            self._probs = self.probabilities()
+            self._cdf = np.cumsum(self._probs)
+
+        # inverse transform sampling, O(n_samples log n_train) per mini batch
+        u = np.random.rand(n_samples) * self._cdf[-1]
+        idx = np.minimum(np.searchsorted(self._cdf, u, side='right'), self.n_samples - 1)
+
+        return idx, 1.0 / (self.n_samples * self._probs[idx])
+
+    def update(self, idx, losses, eps=1e-6):
+        """
+        Set the weights of the given samples to their (current) loss values.
+
+        Parameters
+        ----------
+        idx : array
+            The indices of the samples.
+        losses : array
+            The loss value of every sample.
+        eps : float, optional
+            Small positive constant added to the losses. The default is 1e-6.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.weights[idx] = np.abs(losses) + eps
+        self._cdf = None
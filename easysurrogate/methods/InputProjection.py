@@ -0,0 +1,63 @@
+"""
+Class for a linear projection of the input features onto a low-dimensional subspace.
+"""
+
+import numpy as np
+
+
+class InputProjection:
+    """
+    Linear input-reduction stage z = W^T (x - mean) / std, where the D x d matrix W
+    has orthonormal columns that span e.g. an active subspace. It can be passed to the
+    train subroutine of a surrogate (projection=...), which then trains on, and predicts
+    with, the d reduced coordinates z instead of the D features x. A projection is
+    obtained from a trained DAS surrogate with DAS_Surrogate.get_projection.
+    """
+
+    def __init__(self, W, mean=0.0, std=1.0):
+        """
+        Create an InputProjection object.
+
+        Parameters
+        ----------
+        W : array
+            The projection matrix, of shape (D, d).
+        mean : float or array, optional
+            The mean subtracted from the features before the projection.
+            The default is 0.0.
+        std : float or array, optional
+            The standard deviation by which the features are divided before the
+            projection. The default is 1.0.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.W = np.array(W)
+        self.D, self.d = self.W.shape
+        self.mean = np.array(mean).flatten()
+        self.std = np.array(std).flatten()
+
+    def transform(self, X):
+        """
+        Project the features onto the subspace.
+
+        Parameters
+        ----------
+        X : array or list of arrays
+            The features, of shape (n_samples, D) or (D,). A list of feature arrays is
+            concatenated along the last dimension first.
+
+        Returns
+        -------
+        array
+            The reduced coordinates, of shape (n_samples, d) or (d,).
+
+        """
+        if isinstance(X, list):
+            X = np.concatenate([np.atleast_1d(X_i) for X_i in X], axis=-1)
+        assert X.shape[-1] == self.D, \
+            "Expected %d features, got %d" % (self.D, X.shape[-1])
+        return ((X - self.mean) / self.std) @ self.W
@@ -0,0 +1,206 @@
+"""
+Class for a lazily evaluated, time-lagged training data set.
+"""
+
+from itertools import chain
+import numpy as np
+
+
+class LaggedDataset:
+    """
+    Time-lagged design matrix that only stores the raw feature time series. The
+    rows of the (standardized) lagged feature matrix are gathered on the fly when
+    they are indexed, e.g. for a mini batch. The memory therefore scales with the
+    size of the raw data, instead of with the raw data times the number of lags
+    (times the number of grid points in the case of a local surrogate).
+
+    The row and column ordering is identical to the materialized training data of
+    Feature_Engineering.get_training_data:
+        - non-local: row r contains the features at time max_lag + r.
+        - local: row r contains the features at grid point r // n_times and time
+          max_lag + r % n_times, where n_times = n_samples - max_lag.
+        - the columns contain feature 0 at its lags in descending order, then
+          feature 1 at its lags in descending order, etc. In the case of a local
+          surrogate with a stencil, every lag contributes the neighbours of the
+          point, in the order of the stencil offsets.
+    """
+
+    def __init__(self, feats, lags, local=False, chunk_size=10**4, stencil=None):
+        """
+        Create a LaggedDataset object.
+
+        Parameters
+        ----------
+        feats : list of arrays
+            The raw feature time series, each of shape (n_samples, n_points_i) or
+            (n_samples,). No copies are made.
+        lags : list of lists
+            The time lags of each feature, see Feature_Engineering.get_training_data.
+        local : boolean, optional
+            Extract a separate scalar feature per grid point. In this case all feature
+            arrays must be of shape (n_samples, n_points). The default is False.
+        chunk_size : int, optional
+            The number of rows gathered at once when computing moments or converting
+            to an array. The default is 10**4.
+        stencil : Stencil, optional
+            The neighbourhood of a local surrogate. The default is None, meaning the
+            features of the point itself only.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        assert len(lags) == len(feats), 'Error: no specified lags for one of the features'
+
+        self.feats = feats
+        self.lags = [np.sort(lags_i)[::-1] for lags_i in lags]
+        self.max_lag = np.max(list(chain(*lags)))
+        self.local = local
+        self.chunk_size = chunk_size
+
+        # the number of lagged samples per time series
+        self.n_times = feats[0].shape[0] - self.max_lag
+
+        if local:
+            self.n_points = feats[0].shape[1]
+            if stencil is None:
+                self.neighbours = None
+                n_cols = [1] * len(feats)
+            else:
+                # the neighbour indices of every point, per feature
+                self.neighbours = stencil.indices(self.n_points)
+                n_cols = stencil.n_offsets
+        else:
+            self.n_points = 1
+            self.neighbours = None
+            n_cols = [1 if X_i.ndim == 1 else X_i.shape[1] for X_i in feats]
+
+        self.shape = (self.n_times * self.n_points,
+                      int(np.sum([len(lags_i) * n for lags_i, n in zip(self.lags, n_cols)])))
+        self.ndim = 2
+        self.dtype = feats[0].dtype
+
+        # standardization, applied when rows are gathered
+        self.shift = 0.0
+        self.scale = 1.0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        return self.to_array(dtype=dtype)
+
+    def __getitem__(self, idx):
+        """
+        Gather rows of the lagged feature matrix.
+
+        Parameters
+        ----------
+        idx : int, slice or array of int
+            The row indices.
+
+        Returns
+        -------
+        array
+            The lagged features, of shape (n_in,) for an integer index and
+            (n_rows, n_in) otherwise.
+
+        """
+        if isinstance(idx, slice):
+            idx = np.arange(*idx.indices(self.shape[0]))
+        elif np.ndim(idx) == 0:
+            return self[np.array([idx])][0]
+
+        idx = np.asarray(idx).flatten()
+        idx = np.where(idx < 0, idx + self.shape[0], idx)
+
+        # the time and grid point of every row
+        times = idx % self.n_times + self.max_lag
+        points = idx // self.n_times
+
+        columns = []
+        for i, (X_i, lags_i) in enumerate(zip(self.feats, self.lags)):
+            for lag in lags_i:
+                if self.local and self.neighbours is not None:
+                    nbrs = self.neighbours[i][points]
+                    columns.append(X_i[(times - lag)[:, np.newaxis], nbrs])
+                elif self.local:
+                    columns.append(X_i[times - lag, points].reshape([-1, 1]))
+                else:
+                    columns.append(X_i[times - lag].reshape([idx.size, -1]))
+
+        return (np.concatenate(columns, axis=1) - self.shift) / self.scale
+
+    def chunks(self):
+        """
+        Generator over consecutive row blocks of at most chunk_size rows.
+        """
+        for start in range(0, self.shape[0], self.chunk_size):
+            yield self[start:start + self.chunk_size]
+
+    def to_array(self, dtype=None):
+        """
+        Materialize the full lagged feature matrix. The chunks are written into a single
+        preallocated array.
+
+        Parameters
+        ----------
+        dtype : data type, optional
+            The data type of the array, e.g. 'float32' to reduce the memory footprint.
+            The default is None, meaning the data type of the gathered rows.
+
+        Returns
+        -------
+        array
+            The lagged feature matrix of shape (n_rows, n_in).
+
+        """
+        if dtype is None:
+            # the data type of the standardized rows
+            dtype = np.result_type(self.dtype, self.shift, self.scale)
+        X = np.empty(self.shape, dtype=dtype)
+        for start, chunk in zip(range(0, self.shape[0], self.chunk_size), self.chunks()):
+            X[start:start + chunk.shape[0]] = chunk
+        return X
+
+    def mean(self, axis=0, **kwargs):
+        """
+        Column mean of the lagged feature matrix, computed chunk by chunk.
+        """
+        assert axis == 0, 'only axis=0 is supported'
+        return np.sum([np.sum(X, axis=0) for X in self.chunks()], axis=0) / self.shape[0]
+
+    def std(self, axis=0, **kwargs):
+        """
+        Column standard deviation of the lagged feature matrix, computed chunk by chunk.
+        """
+        mean = self.mean(axis=axis)
+        var = np.sum([np.sum((X - mean)**2, axis=0) for X in self.chunks()], axis=0)
+        return np.sqrt(var / self.shape[0])
+
+    def standardize(self, mean, std):
+        """
+        Return a standardized view of the data set, which shares the raw feature
+        time series with this object.
+
+        Parameters
+        ----------
+        mean : array
+            The mean to subtract from every row.
+        std : array
+            The standard deviation to divide every row by.
+
+        Returns
+        -------
+        LaggedDataset
+            The standardized data set.
+
+        """
+        dataset = LaggedDataset.__new__(LaggedDataset)
+        dataset.__dict__.update(self.__dict__)
+        # combine with the present standardization, if any
+        dataset.shift = self.shift + mean * self.scale
+        dataset.scale = self.scale * std
+        return dataset
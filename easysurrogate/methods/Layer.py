@@ -219,6 +219,24 @@ class Layer:
         # compute the gradient of the activation function,
         self.compute_grad_Phi()
 
+    def get_activation(self):
+        """
+        Return the activation function of this layer, as a function f(a, layer) that
+        overwrites the array a with the activation of a. Used to pre-resolve the
+        activation function once, instead of dispatching on its name every call.
+
+        Returns
+        -------
+        function
+            The in-place activation function.
+
+        """
+        if self.activation not in ACTIVATIONS:
+            print('Unknown activation type')
+            sys.exit()
+
+        return ACTIVATIONS[self.activation]
+
     def compute_grad_Phi(self):
         """
         Compute the gradient in the activation function Phi wrt its input
@@ -472,7 +490,7 @@ class Layer:
         delta_ho_grad_Phi = self.delta_ho * self.grad_Phi
         self.L_grad_W = np.dot(h_rm1, delta_ho_grad_Phi.T)# / self.batch_size
 
-    def back_prop(self, y_i):
+    def back_prop(self, y_i, sample_weights=None):
         """
         Perform the backpropogation operations of the current layer.
 
@@ -480,6 +498,10 @@ class Layer:
         ----------
         y_i : array
             The target data.
+        sample_weights : array, optional
+            Factors multiplying the loss of every sample in the batch, e.g. the
+            importance weights of an ImportanceSampler. Only used in the output
+            layer. The default is None.
 
         Returns
         -------
@@ -489,6 +511,55 @@ class Layer:
 
         if self.r == self.n_layers:
             self.compute_delta_oo(y_i)
+            # weighted loss: the gradients of all layers are linear in delta_ho
+            if sample_weights is not None:
+                self.delta_ho = self.delta_ho * sample_weights
         else:
             self.compute_delta_ho()
         self.compute_L_grad_W()
+
+
+##########################################################
+# In-place activation functions, matching compute_output #
+##########################################################
+
+
+def _linear(a, layer):
+    pass
+
+
+def _sigmoid(a, layer):
+    np.negative(a, out=a)
+    np.exp(a, out=a)
+    np.subtract(1.0, a, out=a)
+    np.reciprocal(a, out=a)
+
+
+def _relu(a, layer):
+    np.maximum(a, 0.0, out=a)
+
+
+def _leaky_relu(a, layer):
+    a[a <= 0.0] *= 0.01
+
+
+def _parametric_relu(a, layer):
+    a[a <= 0.0] *= layer.relu_a
+
+
+def _softplus(a, layer):
+    np.exp(a, out=a)
+    np.log1p(a, out=a)
+
+
+def _tanh(a, layer):
+    np.tanh(a, out=a)
+
+
+def _hard_tanh(a, layer):
+    np.clip(a, -1.0, 1.0, out=a)
+
+
+ACTIVATIONS = {'linear': _linear, 'sigmoid': _sigmoid, 'relu': _relu,
+               'leaky_relu': _leaky_relu, 'parametric_relu': _parametric_relu,
+               'softplus': _softplus, 'tanh': _tanh, 'hard_tanh': _hard_tanh}
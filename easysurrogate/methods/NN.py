@@ -17,6 +17,8 @@ except ImportError:
 
 from .Layer import Layer
 from .DAS_Layer import DAS_Layer
+from .LaggedDataset import LaggedDataset
+from .ChunkedDataset import ChunkedDataset
 
 
 class ANN:
@@ -29,15 +31,15 @@ class ANN:
                  activation_out='linear', n_softmax=0, n_layers=2, n_neurons=16,
                  bias=True, batch_size=1, param_specific_learn_rate=True,
                  save=False, on_gpu=False, name='ANN',
-                 standardize_X=True, standardize_y=True, **kwargs):
+                 standardize_X=True, standardize_y=True, copy_data=True, **kwargs):
         """
         Initialize the Artificial Neural Network object.
 
         Parameters
         ----------
-        X : array
+        X : array, LaggedDataset or ChunkedDataset
             The input features.
-        y : array
+        y : array or ChunkedDataset
             The target data.
         alpha : float, optional
             The learning rate. The default is 0.001.
@@ -89,6 +91,10 @@ class ANN:
             Standardize the features. The default is True.
         standardize_y : boolean, optional
             Standardize the target data. The default is True.
+        copy_data : boolean, optional
+            If False, writeable floating-point arrays X and y are standardized in place,
+            such that no standardized copy of the training data is made. The arrays keep
+            their dtype, e.g. float32 features are stored as float32. The default is True.
 
         Returns
         -------
@@ -127,14 +133,19 @@ class ANN:
         # standardize the training data
         if standardize_X:
 
-            self.X_mean = np.mean(X, axis=0)
-            self.X_std = np.std(X, axis=0)
-            self.X = (X - self.X_mean) / self.X_std
+            self.X_mean, self.X_std = self._moments(X)
+            # lazily evaluated training data is standardized when rows are gathered
+            if isinstance(X, (LaggedDataset, ChunkedDataset)):
+                self.X = X.standardize(self.X_mean, self.X_std)
+            else:
+                self.X = self._standardize(X, self.X_mean, self.X_std, copy_data)
 
         if standardize_y:
-            self.y_mean = np.mean(y, axis=0)
-            self.y_std = np.std(y, axis=0)
-            self.y = (y - self.y_mean) / self.y_std
+            self.y_mean, self.y_std = self._moments(y)
+            if isinstance(y, ChunkedDataset):
+                self.y = y.standardize(self.y_mean, self.y_std)
+            else:
+                self.y = self._standardize(y, self.y_mean, self.y_std, copy_data)
         self.standardize_X = standardize_X
         self.standardize_y = standardize_y
 
@@ -289,6 +300,75 @@ class ANN:
         # print some network stats to screen
         self.print_network_info()
 
+    @staticmethod
+    def _moments(X, chunk_size=10**4):
+        """
+        Compute the column mean and standard deviation. Arrays are processed in blocks of
+        chunk_size rows, in double precision, such that no temporary copy of the full
+        array is made.
+
+        Parameters
+        ----------
+        X : array, LaggedDataset or ChunkedDataset
+            The data.
+        chunk_size : int, optional
+            The number of rows per block. The default is 10**4.
+
+        Returns
+        -------
+        mean, std (arrays).
+
+        """
+        if not isinstance(X, np.ndarray) or X.ndim != 2:
+            return np.mean(X, axis=0), np.std(X, axis=0)
+
+        n_rows = X.shape[0]
+        mean = np.zeros(X.shape[1])
+        for start in range(0, n_rows, chunk_size):
+            mean += np.sum(X[start:start + chunk_size], axis=0, dtype=np.float64)
+        mean /= n_rows
+        var = np.zeros(X.shape[1])
+        for start in range(0, n_rows, chunk_size):
+            var += np.sum((X[start:start + chunk_size] - mean)**2, axis=0)
+        return mean, np.sqrt(var / n_rows)
+
+    @staticmethod
+    def _standardize(X, mean, std, copy_data=True):
+        """
+        Standardize an array, keeping its floating-point dtype.
+
+        Parameters
+        ----------
+        X : array
+            The data.
+        mean : array
+            The mean to subtract from every row.
+        std : array
+            The standard deviation to divide every row by.
+        copy_data : boolean, optional
+            If False and X is a writeable floating-point array, X is overwritten.
+            The default is True.
+
+        Returns
+        -------
+        array
+            The standardized data.
+
+        """
+        X = np.asanyarray(X)
+        if not np.issubdtype(X.dtype, np.floating):
+            return (X - mean) / std
+
+        mean = np.asarray(mean, dtype=X.dtype)
+        std = np.asarray(std, dtype=X.dtype)
+        if copy_data or not X.flags.writeable:
+            # a single new array of the same dtype
+            X = X - mean
+        else:
+            X -= mean
+        X /= std
+        return X
+
     def init_network(self, **kwargs):
         """
         Set up the network structure by creating the Layer objects and
@@ -390,6 +470,84 @@ class ANN:
 
         return self.layers[-1].h
 
+    def compile_predict(self, batch_size=1):
+        """
+        Create a prediction plan for a given batch size, used by predict_fast. The plan
+        contains the pre-resolved activation function of every layer and preallocated
+        buffers for the layer outputs, including the bias neurons. The weights are not
+        copied, such that the plan remains valid when the weights are updated.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            The number of samples predicted at once. The default is 1.
+
+        Returns
+        -------
+        tuple or None
+            The input buffer and a list of (layer, activation, output buffer) tuples.
+            None if a layer has a custom compute_output method, in which case the
+            prediction plan cannot be used.
+
+        """
+        if not hasattr(self, 'predict_plans'):
+            self.predict_plans = {}
+
+        for layer in self.layers[1:]:
+            if type(layer).compute_output is not Layer.compute_output:
+                self.predict_plans[batch_size] = None
+                return None
+
+        # the last row of each buffer is the bias neuron, which is always one
+        h_0 = np.ones([self.n_in + self.layers[0].n_bias, batch_size])
+        layers = []
+        for layer in self.layers[1:]:
+            h_r = np.ones([layer.n_neurons + layer.n_bias, batch_size])
+            layers.append((layer, layer.get_activation(), h_r))
+
+        self.predict_plans[batch_size] = (h_0, layers)
+
+        return self.predict_plans[batch_size]
+
+    def predict_fast(self, X_i):
+        """
+        Run the network forward for prediction only, using a plan from compile_predict.
+        Unlike feed_forward, this does not store the layer outputs or the gradients
+        of the activation functions needed for back propagation.
+
+        Parameters
+        ----------
+        X_i : array
+            The feauture array, needs to have shape [batch size, number of features].
+
+        Returns
+        -------
+        array
+            The prediction of the neural network, shape [number of outputs, batch size].
+            This is a view of a preallocated buffer, which is overwritten by the next call.
+
+        """
+        batch_size = X_i.shape[0]
+
+        if not hasattr(self, 'predict_plans') or batch_size not in self.predict_plans:
+            self.compile_predict(batch_size)
+        plan = self.predict_plans[batch_size]
+
+        # fall back on the standard feed forward step
+        if plan is None or self.dropout:
+            return self.feed_forward(X_i, batch_size=batch_size)
+
+        h_0, layers = plan
+        h_0[0:self.n_in] = X_i.T
+        h = h_0
+        for layer, activation, h_r in layers:
+            a = h_r[0:layer.n_neurons]
+            np.dot(layer.W.T, h, out=a)
+            activation(a, layer)
+            h = h_r
+
+        return h[0:self.layers[-1].n_neurons]
+
     def get_softmax(self, X_i):
         """
         Get the output of the softmax layer.
@@ -397,18 +555,19 @@ class ANN:
         Parameters
         ----------
         X_i : array
-            The input features.
+            The input features, shape [batch size, number of features].
 
         Returns
         -------
         probs : array
             the probabilities of the softmax layer.
-        idx_max : int
-            The softmax output with the highest probability.
+        idx_max : int or array
+            The softmax output with the highest probability. If the batch size is
+            larger than 1, an array with the index per sample.
 
         """
         # feed forward features X_i
-        h = self.feed_forward(X_i, batch_size=1)
+        h = self.predict_fast(X_i)
 
         probs = []
         idx_max = []
@@ -418,10 +577,13 @@ class ANN:
         for h_i in np.split(h, self.n_softmax):
             # compute the softmax probabilities.
             o_i = np.exp(h_i) / np.sum(np.exp(h_i), axis=0)
-            o_i = o_i / np.sum(o_i)
+            o_i = o_i / np.sum(o_i, axis=0)
             probs.append(o_i)
             # the softmax output w
-            idx_max.append(np.argmax(o_i))
+            if X_i.shape[0] == 1:
+                idx_max.append(np.argmax(o_i))
+            else:
+                idx_max.append(np.argmax(o_i, axis=0))
 
             # draw a random sample from the discrete distribution o_i.
             # TODO: Slow for some reason. Find faster implementation.
@@ -469,7 +631,7 @@ class ANN:
         # delta_hy of the (input) layer = the derivative of the normed output
         return self.layers[layer_idx].delta_hy
 
-    def back_prop(self, y_i):
+    def back_prop(self, y_i, sample_weights=None):
         """
         Back-propagation algorithm to find gradient of the loss function with respect
         to the weights of the neural network.
@@ -478,6 +640,10 @@ class ANN:
         ----------
         y_i : array
             The target data on which to evaluate the loss funcion.
+        sample_weights : array, optional
+            Factors multiplying the loss of every sample, of shape (batch size,).
+            If specified, the unweighted loss of every sample is stored in
+            self.sample_losses. The default is None.
 
         Returns
         -------
@@ -486,10 +652,120 @@ class ANN:
         """
 
         # start back propagation over hidden layers, starting with output layer
-        for i in range(self.n_layers, 0, -1):
+        self.layers[self.n_layers].back_prop(y_i, sample_weights=sample_weights)
+        for i in range(self.n_layers - 1, 0, -1):
             self.layers[i].back_prop(y_i)
 
-    def batch(self, X_i, y_i, alpha=0.001, beta1=0.9, beta2=0.999, **kwargs):
+        if sample_weights is not None:
+            self.sample_losses = self.compute_sample_losses(y_i)
+
+    def compute_sample_losses(self, y_i):
+        """
+        The loss value of every sample of the last mini batch, for which the output
+        layer was fed forward and back propagated.
+
+        Parameters
+        ----------
+        y_i : array
+            The target data of the mini batch, shape [number of outputs, batch size].
+
+        Returns
+        -------
+        array
+            The loss values, of shape (batch size,).
+
+        """
+        layer_out = self.layers[self.n_layers]
+        # the cross-entropy loss of the layer is summed over the batch
+        if self.loss == 'cross_entropy':
+            return -np.sum(y_i * np.log(layer_out.o_i + 1e-20), axis=0)
+        L_i = np.asarray(layer_out.L_i)
+        if L_i.ndim == 0:
+            return np.full(self.batch_size, L_i)
+        return L_i.reshape([-1, L_i.shape[-1]]).mean(axis=0)
+
+    def accumulate_gradients(self, X_i, y_i, micro_batch_size, sample_weights=None):
+        """
+        Compute the loss gradients of a (large) mini batch by splitting it into
+        micro batches of at most micro_batch_size samples. The gradients of the
+        micro batches are summed, such that the result equals the gradient of the
+        full mini batch, while the memory of the activations and gradients in the
+        layers is bounded by micro_batch_size.
+
+        Parameters
+        ----------
+        X_i : array
+            The input features of the mini batch, shape [batch size, number of features].
+        y_i : array
+            The target data of the mini batch, shape [number of outputs, batch size].
+        micro_batch_size : int
+            The maximum number of samples per micro batch.
+        sample_weights : array, optional
+            Factors multiplying the loss of every sample of the mini batch.
+            The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        batch_size = X_i.shape[0]
+
+        # the summed gradients and loss values of all micro batches
+        L_grad_W = {}
+        L_grad_Q = {}
+        loss_sum = 0.0
+        sample_losses = []
+
+        for start in range(0, batch_size, micro_batch_size):
+            end = min(start + micro_batch_size, batch_size)
+            # activations are only stored for the samples of the current micro batch
+            self.set_batch_size(end - start)
+            self.feed_forward(X_i[start:end], self.batch_size)
+            if sample_weights is None:
+                self.back_prop(y_i[:, start:end])
+            else:
+                self.back_prop(y_i[:, start:end], sample_weights[start:end])
+                sample_losses.append(self.sample_losses)
+
+            for r in range(1, self.n_layers + 1):
+                layer_r = self.layers[r]
+                if start == 0:
+                    L_grad_W[r] = np.copy(layer_r.L_grad_W)
+                else:
+                    L_grad_W[r] += layer_r.L_grad_W
+                # Deep active subspace layer, L_grad_Q is linear in L_grad_W
+                if isinstance(layer_r, DAS_Layer):
+                    if start == 0:
+                        L_grad_Q[r] = np.copy(layer_r.L_grad_Q)
+                    else:
+                        L_grad_Q[r] += layer_r.L_grad_Q
+
+            # the cross-entropy loss of the layer is already summed over the micro batch
+            if self.loss == 'cross_entropy':
+                loss_sum += self.layers[-1].L_i
+            else:
+                loss_sum += np.mean(self.layers[-1].L_i) * (end - start)
+
+        # store the gradients of the full mini batch in the layers
+        for r in range(1, self.n_layers + 1):
+            self.layers[r].L_grad_W = L_grad_W[r]
+            if r in L_grad_Q:
+                self.layers[r].L_grad_Q = L_grad_Q[r]
+
+        # loss value of the full mini batch, the same as without micro batches
+        if self.loss == 'cross_entropy':
+            self.layers[-1].L_i = loss_sum
+        else:
+            self.layers[-1].L_i = loss_sum / batch_size
+        if sample_weights is not None:
+            self.sample_losses = np.concatenate(sample_losses)
+
+        self.set_batch_size(batch_size)
+
+    def batch(self, X_i, y_i, alpha=0.001, beta1=0.9, beta2=0.999,
+              micro_batch_size=None, sample_weights=None, **kwargs):
         """
         Update the weights using a mini batch.
 
@@ -511,15 +787,25 @@ class ANN:
         beta2 : float, optional
             Parameter controlling the moving average of the squared gradient.
             Used for the parameter-specific learning rate. The default is 0.999.
+        micro_batch_size : int, optional
+            If specified, the gradient of the mini batch is accumulated over micro
+            batches of at most this size before the weights are updated.
+            The default is None.
+        sample_weights : array, optional
+            Factors multiplying the loss of every sample of the mini batch, e.g. the
+            importance weights of an ImportanceSampler. The default is None.
 
         Returns
         -------
         None.
 
         """
-        
-        self.feed_forward(X_i, self.batch_size)
-        self.back_prop(y_i)
+
+        if micro_batch_size is not None and micro_batch_size < X_i.shape[0]:
+            self.accumulate_gradients(X_i, y_i, micro_batch_size, sample_weights)
+        else:
+            self.feed_forward(X_i, self.batch_size)
+            self.back_prop(y_i, sample_weights)
 
         for r in range(1, self.n_layers + 1):
 
@@ -568,7 +854,9 @@ class ANN:
             store_loss=True,
             sequential=False,
             verbose=True,
-            dropout=False, **kwargs):
+            dropout=False,
+            micro_batch_size=None,
+            sampler=None, progress_bar=True, **kwargs):
         """
         Train the neural network using stochastic gradient descent.
 
@@ -589,6 +877,20 @@ class ANN:
             "dropout_prob", as a list of probabilities of retaining neurons
             per layer. Otherwise, 0.8 is used for the input layer, 
             and 0.5 for the hidden layers.
+        micro_batch_size : int, optional
+            Split every mini batch into micro batches of at most micro_batch_size
+            samples, and accumulate the loss gradient over these micro batches
+            before applying a single weight update. This bounds the memory of the
+            activations and gradients, such that large (effective) batch sizes
+            can be used. The default is None, meaning no micro batches are used.
+        sampler : ImportanceSampler, optional
+            Draw the mini batches with the sampling probabilities of the sampler, and
+            multiply the loss of every drawn sample by its importance weight, such
+            that the loss gradient remains unbiased. The stored loss values are then
+            importance-weighted means of the per-sample losses. The default is None,
+            meaning the samples are drawn uniformly.
+        progress_bar : boolean, optional
+            Show a tqdm progress bar. The default is True.
 
         Returns
         -------
@@ -596,6 +898,12 @@ class ANN:
 
         """
 
+        if sampler is not None:
+            assert not isinstance(self.X, ChunkedDataset) and not sequential, \
+                "Importance sampling is not supported for out-of-core or sequential batches"
+            assert sampler.n_samples == self.n_train, \
+                "The sampler has %d weights, expected %d" % (sampler.n_samples, self.n_train)
+
         if dropout:
             self.dropout = dropout
             # use standard dropout probabilities
@@ -608,10 +916,17 @@ class ANN:
                 self.dropout_prob = kwargs['dropout_prob']
 
         # loop with tqdm progress bar
-        for i in tqdm(range(n_batch)):
-
+        for i in tqdm(range(n_batch), disable=not progress_bar):
+
+            sample_weights = None
+            # draw the mini batch with probabilities given by the sample weights
+            if sampler is not None:
+                rand_idx, sample_weights = sampler.sample(self.batch_size)
+            # out-of-core data: draw the mini batch from the chunk that is in memory
+            elif isinstance(self.X, ChunkedDataset):
+                rand_idx = self.X.sample(self.batch_size, sequential=sequential)
             # select a random training instance (X, y)
-            if not sequential:
+            elif not sequential:
                 rand_idx = np.random.randint(0, self.n_train, self.batch_size)
             # select a random starting point, and use sequential data from there
             else:
@@ -630,12 +945,21 @@ class ANN:
                 self.y[rand_idx].T,
                 alpha=alpha,
                 beta1=self.beta1,
-                beta2=self.beta2)
+                beta2=self.beta2,
+                micro_batch_size=micro_batch_size,
+                sample_weights=sample_weights)
+
+            # adaptive importance sampling, based on the current loss values
+            if sampler is not None and sampler.adaptive:
+                sampler.update(rand_idx, self.sample_losses)
 
             # store the loss value
             if store_loss:
-                l = self.layers[-1].L_i
-                loss_i = np.mean(l)
+                if sampler is not None:
+                    loss_i = np.mean(self.sample_losses * sample_weights)
+                else:
+                    l = self.layers[-1].L_i
+                    loss_i = np.mean(l)
                 self.loss_vals.append(loss_i)
 
                 if np.mod(i, 1000) == 0:
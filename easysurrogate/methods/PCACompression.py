@@ -0,0 +1,130 @@
+"""
+Class for the compression of high-dimensional target data with a truncated PCA.
+"""
+
+import numpy as np
+
+
+class PCACompression:
+    """
+    Truncated principal component analysis of target data of shape (n_samples, n_out).
+    The targets are represented by the coefficients of the leading principal components,
+    such that a surrogate can be trained on n_components << n_out outputs. The full
+    outputs, and their variances in the case of a Gaussian process, are reconstructed
+    from the predicted coefficients.
+    """
+
+    def __init__(self, energy=0.999, n_components=None):
+        """
+        Create a PCACompression object.
+
+        Parameters
+        ----------
+        energy : float, optional
+            The fraction of the total variance of the targets that must be retained by
+            the principal components. The default is 0.999.
+        n_components : int, optional
+            The number of principal components. If specified, energy is ignored.
+            The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        assert 0.0 < energy <= 1.0, "energy must be in (0.0, 1.0]"
+
+        self.energy = energy
+        self.n_components = n_components
+
+    def fit(self, y):
+        """
+        Compute the principal components of the target data.
+
+        Parameters
+        ----------
+        y : array
+            The target data, of shape (n_samples, n_out).
+
+        Returns
+        -------
+        None.
+
+        """
+        y = np.asarray(y).reshape([y.shape[0], -1])
+        self.n_out = y.shape[1]
+        self.mean = np.mean(y, axis=0)
+
+        # thin SVD of the centered targets, the rows of V are the principal components
+        _, s, V = np.linalg.svd(y - self.mean, full_matrices=False)
+        var = s**2
+        self.explained_variance_ratio = var / np.sum(var) if np.sum(var) > 0 else var
+
+        if self.n_components is None:
+            cum_energy = np.cumsum(self.explained_variance_ratio)
+            n_components = int(np.searchsorted(cum_energy, self.energy * (1.0 - 1e-12))) + 1
+        else:
+            n_components = self.n_components
+        n_components = min(n_components, V.shape[0])
+
+        # array of shape (n_components, n_out)
+        self.components = V[0:n_components]
+        self.n_components = n_components
+
+        print('Compressed %d outputs to %d principal components (%.4f%% of the variance)' %
+              (self.n_out, n_components,
+               100 * np.sum(self.explained_variance_ratio[0:n_components])))
+
+    def transform(self, y):
+        """
+        Compute the coefficients of the principal components.
+
+        Parameters
+        ----------
+        y : array
+            The target data, of shape (n_samples, n_out) or (n_out,).
+
+        Returns
+        -------
+        array
+            The coefficients, of shape (n_samples, n_components) or (n_components,).
+
+        """
+        return (y - self.mean) @ self.components.T
+
+    def inverse_transform(self, coeffs):
+        """
+        Reconstruct the outputs from the coefficients of the principal components.
+
+        Parameters
+        ----------
+        coeffs : array
+            The coefficients, of shape (n_samples, n_components) or (n_components,).
+
+        Returns
+        -------
+        array
+            The outputs, of shape (n_samples, n_out) or (n_out,).
+
+        """
+        return coeffs @ self.components + self.mean
+
+    def inverse_variance(self, var):
+        """
+        Propagate the variances of independent coefficients to the variances of the
+        outputs.
+
+        Parameters
+        ----------
+        var : array
+            The variances of the coefficients, of shape (n_samples, n_components)
+            or (n_components,).
+
+        Returns
+        -------
+        array
+            The variances of the outputs, of shape (n_samples, n_out) or (n_out,).
+
+        """
+        return var @ self.components**2
@@ -0,0 +1,195 @@
+"""
+Class for a fixed-capacity replay buffer, used to store online training data.
+"""
+
+import numpy as np
+
+
+class ReplayBuffer:
+    """
+    Fixed-capacity, array-backed circular buffer for (feature, target) pairs.
+    Inserting a new sample is O(1). Once the buffer is full the oldest sample is
+    overwritten. Every sample has a priority, which can be used to draw
+    (error-weighted) mini batches.
+
+    Method:
+        Schaul, Tom, et al. "Prioritized experience replay."
+        arXiv preprint arXiv:1511.05952 (2015).
+    """
+
+    def __init__(self, capacity, alpha=0.6):
+        """
+        Create a ReplayBuffer object.
+
+        Parameters
+        ----------
+        capacity : int
+            The maximum number of samples stored in the buffer.
+        alpha : float, optional
+            Exponent of the priorities in the sampling probabilities. alpha=0
+            corresponds to uniform sampling. The default is 0.6.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.capacity = capacity
+        self.alpha = alpha
+        # the number of samples currently stored
+        self.size = 0
+        # the slot in which the next sample is stored
+        self.idx = 0
+        # storage is allocated when the first sample is appended
+        self.feats = None
+        self.target = None
+        self.priorities = np.zeros(capacity)
+        # the total number of appended samples, and the number of the sample in every
+        # slot, used to detect slots that were overwritten since they were sampled
+        self.n_appended = 0
+        self.insertions = np.zeros(capacity, dtype=int)
+
+    def __len__(self):
+        return self.size
+
+    def append(self, feats, target, priority=None):
+        """
+        Store a new sample, overwriting the oldest sample if the buffer is full.
+
+        Parameters
+        ----------
+        feats : list of arrays
+            The feature arrays of a single sample.
+        target : array
+            The target of a single sample.
+        priority : float, optional
+            The priority of the sample. The default is None, in which case the
+            maximum priority in the buffer is used, such that every new sample is
+            drawn at least once with high probability.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # allocate the storage using the shape of the first sample
+        if self.feats is None:
+            self.feats = [np.zeros((self.capacity,) + np.shape(feat)) for feat in feats]
+            self.target = np.zeros((self.capacity,) + np.shape(target))
+
+        for i, feat in enumerate(feats):
+            self.feats[i][self.idx] = feat
+        self.target[self.idx] = target
+
+        if priority is None:
+            priority = np.max(self.priorities[0:self.size]) if self.size > 0 else 1.0
+        self.priorities[self.idx] = priority
+        self.n_appended += 1
+        self.insertions[self.idx] = self.n_appended
+
+        self.idx = (self.idx + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def chronological_slots(self):
+        """
+        Return the buffer slots ordered from the oldest to the most recent sample.
+
+        Returns
+        -------
+        array
+            The ordered slot indices.
+
+        """
+        if self.size < self.capacity:
+            return np.arange(self.size)
+        return np.roll(np.arange(self.capacity), -self.idx)
+
+    def get_window(self):
+        """
+        Return all stored samples in chronological order.
+
+        Returns
+        -------
+        feats : list of arrays
+            The feature arrays, each of shape (size, ...).
+        target : array
+            The target array of shape (size, ...).
+
+        """
+        # no copy is required until the buffer wraps around
+        if self.size < self.capacity or self.idx == 0:
+            return [feat[0:self.size] for feat in self.feats], self.target[0:self.size]
+
+        slots = self.chronological_slots()
+        return [feat[slots] for feat in self.feats], self.target[slots]
+
+    def sample(self, n_samples, prioritized=True, start=0):
+        """
+        Draw the positions of a mini batch of samples, without replacement.
+
+        Parameters
+        ----------
+        n_samples : int
+            The number of samples to draw. Is limited to the number of candidates.
+        prioritized : boolean, optional
+            Draw samples with probabilities proportional to priority**alpha. If False,
+            draw samples uniformly. The default is True.
+        start : int, optional
+            Only consider samples from the start-th oldest sample onwards, e.g. to
+            leave room for time lags. The default is 0.
+
+        Returns
+        -------
+        array
+            The chronological positions of the drawn samples, i.e. position 0 is the
+            oldest sample in the buffer. Use chronological_slots()[positions] to
+            get the corresponding buffer slots.
+
+        """
+        n_cands = self.size - start
+        n_samples = min(n_samples, n_cands)
+
+        if not prioritized:
+            return start + np.random.choice(n_cands, n_samples, replace=False)
+
+        probs = self.priorities[self.chronological_slots()[start:]]**self.alpha
+        probs = probs / np.sum(probs)
+
+        return start + np.random.choice(n_cands, n_samples, replace=False, p=probs)
+
+    def update_priorities(self, slots, errors, eps=1e-6, insertions=None):
+        """
+        Set the priorities of the given buffer slots to the (mean) errors of the
+        corresponding samples. A slot can appear multiple times, e.g. when a sample
+        is split into several local training rows, in which case the mean error is used.
+
+        Parameters
+        ----------
+        slots : array of int
+            The buffer slots.
+        errors : array
+            The error of each entry in slots.
+        eps : float, optional
+            Small positive constant, such that no sample gets zero priority.
+            The default is 1e-6.
+        insertions : array of int, optional
+            The values of self.insertions[slots] at the time the slots were sampled.
+            If specified, slots that have been overwritten by new samples since then
+            are skipped, such that new samples keep their initial priority.
+            The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        if insertions is not None:
+            current = self.insertions[slots] == insertions
+            slots, errors = slots[current], errors[current]
+
+        error_sum = np.bincount(slots, weights=errors, minlength=self.capacity)
+        counts = np.bincount(slots, minlength=self.capacity)
+        idx = counts > 0
+        self.priorities[idx] = error_sum[idx] / counts[idx] + eps
@@ -0,0 +1,85 @@
+"""
+Class for running (streaming) estimates of the mean and standard deviation.
+"""
+
+import numpy as np
+
+
+class RunningMoments:
+    """
+    Running estimates of the mean and standard deviation of a data stream, updated
+    incrementally with batches of new samples. Uses the Welford / Chan et al. update
+    for cumulative moments, or exponentially weighted moments if decay is specified.
+
+    Method:
+        Chan, Tony F., Gene H. Golub, and Randall J. LeVeque. "Updating formulae and
+        a pairwise algorithm for computing sample variances." COMPSTAT 1982.
+    """
+
+    def __init__(self, mean, std, n=0, decay=None):
+        """
+        Create a RunningMoments object.
+
+        Parameters
+        ----------
+        mean : array
+            The initial mean, e.g. computed from the offline training data.
+        std : array
+            The initial standard deviation.
+        n : int, optional
+            The number of samples used to compute the initial moments. Only used for
+            cumulative moments. The default is 0.
+        decay : float, optional
+            If specified, use exponentially weighted moments, where every new sample
+            gets weight decay in (0, 1]. The default is None, in which case the
+            cumulative moments of all samples are computed.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.mean = np.array(mean, dtype=float)
+        self.var = np.array(std, dtype=float)**2
+        self.n = n
+        self.decay = decay
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def update(self, X):
+        """
+        Update the moments with a batch of new samples.
+
+        Parameters
+        ----------
+        X : array
+            The new samples, of shape (n_samples, n_variables).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        m = X.shape[0]
+        if m == 0:
+            return
+
+        # the moments of the new batch
+        mean_b = np.mean(X, axis=0)
+        var_b = np.var(X, axis=0)
+
+        # the weight of the new batch
+        if self.decay is None:
+            w = m / (self.n + m)
+        else:
+            w = 1.0 - (1.0 - self.decay)**m
+
+        # combine the old moments and the batch moments
+        delta = mean_b - self.mean
+        self.mean = self.mean + w * delta
+        self.var = (1.0 - w) * self.var + w * var_b + w * (1.0 - w) * delta**2
+        self.n += m
@@ -1,6 +1,4 @@
 import numpy as np
-from scipy import stats
-from itertools import chain
 
 
 class SimpleBin:
@@ -17,63 +15,66 @@ class SimpleBin:
 
         """
 
-        if not hasattr(feat_eng, 'y_binned'):
+        if not hasattr(feat_eng, 'binned_data'):
             print("Error: feat_eng object does not contain binned data")
             print("Run the bin_data(..) subroutine of feat_eng")
             return
 
-        # number of variables
+        # number of variables and bins per variable
         self.n_vars = feat_eng.n_vars
+        self.n_bins = feat_eng.n_bins
 
-        # dict of the binned data. To access the binned data of bin 1 of the
-        # 6-th variable use: y_binned[5][1]
-        self.y_binned = feat_eng.y_binned
-        self.y_binned_mean = feat_eng.y_binned_mean
+        # flat array of the binned data. To access the binned data of bin 1 of the
+        # 6-th variable use: binned_data[bin_offsets[5 * n_bins + 1]:bin_offsets[5 * n_bins + 2]]
+        self.binned_data = feat_eng.binned_data
+        self.bin_offsets = feat_eng.bin_offsets
+        self.bin_means = feat_eng.bin_means
 
     def resample(self, bin_idx):
         """
         Resamples reference data from bins specified by bin indices bin_idx.
-        Bin indices are integers >= 1.
+        Bin indices are integers >= 0.
 
         Parameters
         ----------
         bin_idx : array of integers, size (nvars,): the bin indices of each
-                  output variable
+                  output variable. Can also be of size (n_samples, nvars) to
+                  resample for multiple samples at once.
 
         Returns
         -------
-        pred : array of floats, size (nvars,): array of resampled reference
+        pred : array of floats, same size as bin_idx: array of resampled reference
                data. Samples are drawn from the bins specified by bin_idx
 
         """
 
-        pred = np.zeros(self.n_vars)
+        # the location of the selected bins in bin_offsets
+        bin_idx = np.asarray(bin_idx) + np.arange(self.n_vars) * self.n_bins
+        start = self.bin_offsets[bin_idx]
+        counts = self.bin_offsets[bin_idx + 1] - start
 
-        for i in range(self.n_vars):
-            pred[i] = np.random.choice(self.y_binned[i][bin_idx[i]][0])
+        assert np.all(counts > 0), "Cannot resample from an empty bin"
 
-        return pred
+        # draw a random sample from every selected bin
+        idx = start + np.floor(np.random.rand(*bin_idx.shape) * counts).astype('int')
+
+        return self.binned_data[idx]
 
     def resample_mean(self, bin_idx):
         """
         Resamples reference bin mean specified by bin indices bin_idx.
-        Bin indices are integers >= 1.
+        Bin indices are integers >= 0.
 
         Parameters
         ----------
         bin_idx : array of integers, size (nvars,): the bin indices of each
-                  output variable
+                  output variable. Can also be of size (n_samples, nvars).
 
         Returns
         -------
-        pred : array of floats, size (nvars,): array of resampled bin mean
+        pred : array of floats, same size as bin_idx: array of resampled bin mean
                data.
 
         """
 
-        pred = np.zeros(self.n_vars)
-
-        for i in range(self.n_vars):
-            pred[i] = self.y_binned_mean[i][bin_idx[i]]
-
-        return pred
+        return self.bin_means[np.arange(self.n_vars), np.asarray(bin_idx)]
@@ -0,0 +1,101 @@
+"""
+Class for a stencil of neighbouring grid points, used to create neighbourhood features.
+"""
+
+import numpy as np
+
+
+class Stencil:
+    """
+    Stencil of a local surrogate. The feature vector of a grid point then contains the
+    features at a number of neighbouring points, specified as offsets relative to the
+    point, instead of the features at the point only. The neighbours are obtained with
+    precomputed index arrays, one per feature, of shape (n_points, n_offsets_i), such
+    that the neighbourhood features of all points are created by a single gather
+    instead of a shifted copy of the grid per offset.
+
+    The columns of the neighbourhood features of feature i are ordered as the offsets
+    of feature i.
+    """
+
+    def __init__(self, offsets, grid_shape=None, boundary='periodic'):
+        """
+        Create a Stencil object.
+
+        Parameters
+        ----------
+        offsets : list of lists
+            The offsets of each feature. For a 1D grid the offsets are integers, e.g.
+            [[-1, 0, 1], [0]] uses the left, center and right points of the first
+            feature, and the center point of the second feature. For a multi-dimensional
+            grid the offsets are tuples, e.g. [[(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)]].
+        grid_shape : tuple of int, optional
+            The shape of the grid, of which the points are stored in row-major (C) order
+            in the second dimension of the features. The default is None, meaning a 1D grid.
+        boundary : string, optional
+            'periodic' or 'clamped'. Neighbours outside the grid are wrapped around in
+            the periodic case, and replaced by the nearest boundary point in the clamped
+            case. The default is 'periodic'.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        assert boundary in ['periodic', 'clamped'], \
+            "boundary must be 'periodic' or 'clamped'"
+
+        self.grid_shape = None if grid_shape is None else tuple(grid_shape)
+        self.boundary = boundary
+        ndim = 1 if grid_shape is None else len(grid_shape)
+        # array of shape (n_offsets_i, ndim) per feature
+        self.offsets = [np.array(offsets_i, dtype=int).reshape([len(offsets_i), ndim])
+                        for offsets_i in offsets]
+        self.n_offsets = [offsets_i.shape[0] for offsets_i in self.offsets]
+        self._indices = {}
+
+    def __repr__(self):
+        offsets = [offsets_i.tolist() for offsets_i in self.offsets]
+        return 'Stencil(offsets=%r, grid_shape=%r, boundary=%r)' % \
+            (offsets, self.grid_shape, self.boundary)
+
+    def indices(self, n_points):
+        """
+        The flat indices of the neighbours of every grid point. The indices are
+        computed once per grid size.
+
+        Parameters
+        ----------
+        n_points : int
+            The number of grid points.
+
+        Returns
+        -------
+        list of arrays
+            The neighbour indices of each feature, of shape (n_points, n_offsets_i).
+
+        """
+        if n_points in self._indices:
+            return self._indices[n_points]
+
+        grid_shape = (n_points,) if self.grid_shape is None else self.grid_shape
+        assert np.prod(grid_shape) == n_points, \
+            "The grid shape %s does not match %d points" % (grid_shape, n_points)
+
+        # grid coordinates of every point, shape (ndim, n_points)
+        coords = np.indices(grid_shape).reshape([len(grid_shape), -1])
+
+        indices = []
+        for offsets_i in self.offsets:
+            # coordinates of the neighbours, shape (ndim, n_points, n_offsets_i)
+            nbrs = coords[:, :, np.newaxis] + offsets_i.T[:, np.newaxis, :]
+            for d, n in enumerate(grid_shape):
+                if self.boundary == 'periodic':
+                    nbrs[d] %= n
+                else:
+                    np.clip(nbrs[d], 0, n - 1, out=nbrs[d])
+            indices.append(np.ravel_multi_index(tuple(nbrs), grid_shape))
+
+        self._indices[n_points] = indices
+        return indices
@@ -0,0 +1,174 @@
+"""
+Class for an on-disk cache of prepared training data.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+class TrainingDataCache:
+    """
+    Content-addressed cache of prepared training data. An entry is keyed on a hash of
+    the input arrays and the preparation parameters, and consists of a directory of
+    .npy files, which are returned as read-only memory maps on a cache hit. The total
+    size of the cache directory is bounded, and the least recently used entries are
+    removed when the bound is exceeded.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 2**30):
+        """
+        Create a TrainingDataCache object.
+
+        Parameters
+        ----------
+        cache_dir : string
+            The cache directory. Is created if it does not exist.
+        max_bytes : int, optional
+            The maximum total size of the cache entries in bytes. The default is 10 GiB.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, arrays, **params):
+        """
+        Compute the key of a cache entry.
+
+        Parameters
+        ----------
+        arrays : list of arrays
+            The input arrays, hashed by shape, dtype and content.
+        **params : the preparation parameters, hashed by their string representation.
+            Arrays are hashed by content.
+
+        Returns
+        -------
+        string
+            The key.
+
+        """
+        h = hashlib.sha256()
+        for X in arrays:
+            X = np.ascontiguousarray(X)
+            h.update(str((X.shape, X.dtype.str)).encode())
+            h.update(memoryview(X).cast('B'))
+        for name in sorted(params):
+            value = params[name]
+            if isinstance(value, np.ndarray):
+                value = (value.shape, value.dtype.str, hashlib.sha256(value.tobytes()).hexdigest())
+            h.update(('%s=%r;' % (name, value)).encode())
+        return h.hexdigest()
+
+    def load(self, key):
+        """
+        Load a cache entry.
+
+        Parameters
+        ----------
+        key : string
+            The key of the entry.
+
+        Returns
+        -------
+        dict or None
+            The arrays of the entry as read-only memory maps, or None on a cache miss.
+
+        """
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(path):
+            return None
+
+        # mark the entry as recently used
+        os.utime(path)
+
+        data = {}
+        for fname in os.listdir(path):
+            name, ext = os.path.splitext(fname)
+            if ext == '.npy':
+                data[name] = np.load(os.path.join(path, fname), mmap_mode='r')
+        return data
+
+    def store(self, key, data):
+        """
+        Store a cache entry, and remove the least recently used entries if the cache
+        exceeds max_bytes.
+
+        Parameters
+        ----------
+        key : string
+            The key of the entry.
+        data : dict
+            The arrays to store.
+
+        Returns
+        -------
+        None.
+
+        """
+        path = os.path.join(self.cache_dir, key)
+        if os.path.isdir(path):
+            return
+
+        # write to a temporary directory first, such that entries are always complete
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+        for name, X in data.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(X))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # the entry was stored concurrently
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict(keep=key)
+
+    def size(self, key):
+        """
+        The size in bytes of a cache entry.
+        """
+        path = os.path.join(self.cache_dir, key)
+        return sum(os.path.getsize(os.path.join(path, fname)) for fname in os.listdir(path))
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache size is at most max_bytes.
+
+        Parameters
+        ----------
+        keep : string, optional
+            The key of an entry that is never removed. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        entries = [key for key in os.listdir(self.cache_dir) if not key.startswith('.')
+                   and os.path.isdir(os.path.join(self.cache_dir, key))]
+        # least recently used first
+        entries.sort(key=lambda key: os.path.getmtime(os.path.join(self.cache_dir, key)))
+        sizes = {key: self.size(key) for key in entries}
+        total = sum(sizes.values())
+
+        for key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= sizes[key]
+
+    def clear(self):
+        """
+        Remove all cache entries.
+        """
+        for key in os.listdir(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
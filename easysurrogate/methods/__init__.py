@@ -1,6 +1,16 @@
 #from .resampling import Resampler
 from .NN import ANN
 from .SimpleBin import SimpleBin
+from .ReplayBuffer import ReplayBuffer
+from .RunningMoments import RunningMoments
+from .LaggedDataset import LaggedDataset
+from .DataSplit import DataSplit
+from .ChunkedDataset import ChunkedDataset
+from .TrainingDataCache import TrainingDataCache
+from .Stencil import Stencil
+from .PCACompression import PCACompression
+from .InputProjection import InputProjection
+from .ImportanceSampler import ImportanceSampler
 from .Feature_Engineering import Feature_Engineering
 #from .RNN import RNN
 #from .Input_Layer import Input_Layer
@@ -14,3 +24,4 @@ from .CumSum_Layer import CumSum_Layer
 from .das_surrogate import DAS_Surrogate
 from .gp_surrogate import GP_Surrogate
 from .GP import GP
+from .CrossValidation import CrossValidation
@@ -6,6 +6,9 @@ Author: W. Edeling
 ==============================================================================
 """
 
+import copy
+import threading
+import numpy as np
 import easysurrogate as es
 from ..campaign import Campaign
 
@@ -33,7 +36,9 @@ class ANN_Surrogate(Campaign):
               learning_rate = 0.001, decay_rate = 0.9, beta1 = 0.9,
               batch_size=64, lamb=0.0,
               standardize_X=True, standardize_y=True,
-              dropout=False, **kwargs):
+              dropout=False, lazy=False, split=None, chunk_size=None, cache=None,
+              stencil=None, n_select=None, select_method='farthest', dtype=None,
+              pca_energy=None, projection=None, sample_weights=None, **kwargs):
         """
         Perform back propagation to train the ANN
 
@@ -62,6 +67,46 @@ class ANN_Surrogate(Campaign):
         batch_size : Mini batch size. The default is 64.
         lamb : L2 regularization parameter. The default is 0.0.
         dropout : Boolean flag for use of dropout regularization. 
+        lazy : Boolean flag to gather the time-lagged training features on the fly
+               for every mini batch, instead of materializing the full lagged
+               feature matrix. Only used if lags are specified. The default is False.
+        split : precomputed train / test split (DataSplit), e.g. feat_eng.split of
+                another surrogate trained on the same data. The default is None.
+        chunk_size : If specified, feats and target are on-disk arrays (e.g. h5py
+                     datasets) that are read in chunks of chunk_size samples during
+                     training, see Feature_Engineering.get_chunked_training_data.
+                     Not supported for time-lagged surrogates. The default is None.
+        cache : TrainingDataCache object, in which the prepared training data is
+                stored and looked up. The default is None.
+        stencil : Stencil object. If specified, the input features of a local
+                  surrogate are the features at the neighbouring points given by
+                  the stencil offsets. The default is None.
+        dtype : storage data type of the training features, e.g. 'float32' or
+                'float16'. The features are standardized in place, such that a
+                single copy of the training features is stored. The default is
+                None, meaning the data type of feats.
+        pca_energy : If specified, the network is trained on the coefficients of the
+                     leading principal components of the target, which retain this
+                     fraction of the variance (see PCACompression). The full outputs
+                     are reconstructed in predict. Not supported for local surrogates,
+                     out-of-core data or online training. The default is None.
+        projection : InputProjection object, e.g. obtained from
+                     DAS_Surrogate.get_projection. If specified, the network is
+                     trained on, and predicts with, the projected features. Not
+                     supported for lagged or local surrogates. The default is None.
+        n_select : If specified, train on a representative subset of n_select
+                   samples, see Feature_Engineering.select_subset. Ignores test_frac
+                   and split. Not supported for time-lagged surrogates.
+                   The default is None.
+        select_method : The subset selection method, 'farthest', 'kmeans' or 'bins'.
+                        The default is 'farthest'.
+        sample_weights : If specified, the mini batches are drawn with importance
+                         sampling, and the loss is reweighted such that the gradient
+                         remains unbiased (see ImportanceSampler). 'density' for the
+                         inverse density of the binned target, which favours the tails
+                         of a heavy-tailed target, 'loss' for the current loss value of
+                         every sample, or an array with a weight per training sample.
+                         The default is None, meaning uniform sampling.
 
         Returns
         -------
@@ -81,14 +126,52 @@ class ANN_Surrogate(Campaign):
         # loss function
         self.loss = loss
 
+        # reduce the input features to the coordinates of the projection
+        self.projection = projection
+        if projection is not None:
+            assert lags is None and not local and chunk_size is None, \
+                "Input projection is not supported for lagged, local or out-of-core surrogates"
+            if not isinstance(feats, list):
+                feats = [feats]
+            n_samples = feats[0].shape[0]
+            feats = projection.transform(
+                np.concatenate([X_i.reshape([n_samples, -1]) for X_i in feats], axis=1))
+
+        # select a representative subset of the samples for training
+        if n_select is not None:
+            assert lags is None, "Subset selection is not supported for lagged surrogates"
+            split = self.feat_eng.subset_split(feats, n_select, method=select_method)
+
         # prepare the training data
-        X_train, y_train, _, _ = self.feat_eng.get_training_data(
-            feats, target, lags=lags, local=local, test_frac=test_frac, train_first=True)
+        if chunk_size is not None:
+            assert lags is None, "Out-of-core training data is not supported for lagged surrogates"
+            assert stencil is None, "Out-of-core training data is not supported with a stencil"
+            X_train, y_train, _, _ = self.feat_eng.get_chunked_training_data(
+                feats, target, local=local, test_frac=test_frac, chunk_size=chunk_size)
+        else:
+            X_train, y_train, _, _ = self.feat_eng.get_training_data(
+                feats, target, lags=lags, local=local, test_frac=test_frac, train_first=True,
+                lazy=lazy, split=split, cache=cache, stencil=stencil, dtype=dtype)
         self.max_lag = self.feat_eng.max_lag
 
+        # compress the target to the coefficients of its leading principal components
+        if pca_energy is not None:
+            assert not local and chunk_size is None, \
+                "Output compression is not supported for local or out-of-core surrogates"
+            self.output_pca = es.methods.PCACompression(energy=pca_energy)
+            self.output_pca.fit(y_train)
+            y_train = self.output_pca.transform(y_train)
+        else:
+            self.output_pca = None
+
         # number of output neurons
         n_out = y_train.shape[1]
 
+        # weighted sampling of the mini batches
+        sampler = None
+        if sample_weights is not None:
+            sampler = self.feat_eng.importance_sampler(y_train, sample_weights)
+
         # create the feed-forward ANN
         self.neural_net = es.methods.ANN(X=X_train, y=y_train,
                                          n_layers=n_layers, n_neurons=n_neurons,
@@ -100,6 +183,7 @@ class ANN_Surrogate(Campaign):
                                          decay_rate=decay_rate, beta1=beta1,
                                          standardize_X=standardize_X,
                                          standardize_y=standardize_y,
+                                         copy_data=False,
                                          save=False,
                                          **kwargs)
 
@@ -108,7 +192,7 @@ class ANN_Surrogate(Campaign):
 
         # train network for n_iter mini batches
         self.neural_net.train(n_iter, store_loss=True, dropout=dropout,
-                              **kwargs)
+                              sampler=sampler, **kwargs)
         self.set_data_stats()
         if lags is not None:
             self.feat_eng.initial_condition_feature_history(feats)
@@ -155,7 +239,8 @@ class ANN_Surrogate(Campaign):
 
         return df_dx
 
-    def train_online(self, n_iter=1, batch_size=1, verbose=False, sequential=False):
+    def train_online(self, n_iter=1, batch_size=1, verbose=False, sequential=False,
+                     asynchronous=False, swap_interval=1, n_samples=None, prioritized=False):
         """
         Perform online training, i.e. backpropagation while the surrogate is coupled
         to the macroscopic governing equations.
@@ -173,6 +258,14 @@ class ANN_Surrogate(Campaign):
         batch_size : Mini batch size. Default is 1.
         verbose: print loss to screen during back propagation. Default is False.
         sequential: do not randomly sample the training data, Default is False.
+        asynchronous: train a shadow copy of the neural network in a background thread,
+                      while predictions are made with the live copy. Default is False.
+        swap_interval: in asynchronous mode, the trained shadow copy replaces the live
+                       copy every swap_interval train_online calls. Default is 1.
+        n_samples: only train on n_samples (time) samples drawn from the online replay
+                   buffer, instead of on the entire window. Default is None.
+        prioritized: draw the n_samples samples with probabilities based on the errors
+                     of the previous online step. Default is False.
 
         Returns
         -------
@@ -180,19 +273,194 @@ class ANN_Surrogate(Campaign):
 
         """
 
+        assert getattr(self, 'output_pca', None) is None, \
+            "Online training is not supported for surrogates with output compression (pca_energy)"
+
         X_train, y_train = self.feat_eng.get_online_training_data(n_in=self.neural_net.n_in,
-                                                                  n_out=self.neural_net.n_out)
+                                                                  n_out=self.neural_net.n_out,
+                                                                  n_samples=n_samples,
+                                                                  prioritized=prioritized)
+
+        # the replay buffer slots of the training rows, used to update the priorities,
+        # and the numbers of the samples in these slots at the time of sampling
+        if prioritized:
+            slots = self.feat_eng.online_slots
+            insertions = self.feat_eng.online_buffer.insertions[slots]
+        else:
+            slots, insertions = None, None
+
+        if asynchronous:
+            assert getattr(self, 'feat_moments', None) is None, \
+                "Running data statistics cannot be combined with asynchronous online training"
+            self._train_online_async(X_train, y_train, n_iter, batch_size, verbose,
+                                     sequential, swap_interval, slots, insertions)
+            return
+
+        errors = self._train_online(self.neural_net, X_train, y_train, n_iter, batch_size,
+                                    verbose, sequential, slots is not None)
+        if slots is not None:
+            self.feat_eng.online_buffer.update_priorities(slots, errors, insertions=insertions)
+
+    def _train_online(self, neural_net, X_train, y_train, n_iter, batch_size,
+                      verbose, sequential, compute_errors=False, progress_bar=True):
+        """
+        Run n_iter backpropagation iterations of neural_net on the online training data.
+
+        Parameters
+        ----------
+        neural_net : ANN
+            The neural network to train, either the live or the shadow copy.
+        X_train : array
+            The (unstandardized) online features.
+        y_train : array
+            The (unstandardized) online target data.
+        n_iter : number of back propagation iterations
+        batch_size : Mini batch size.
+        verbose: print loss to screen during back propagation.
+        sequential: do not randomly sample the training data.
+        compute_errors: return the squared errors of the trained network on the rows
+                        of X_train. Default is False.
+        progress_bar: show a progress bar. Default is True.
 
+        Returns
+        -------
+        array or None
+            The errors, used as new priorities, if compute_errors is True.
+
+        """
         # set the training data, training size and batch size for the online backprop step
-        if self.neural_net.batch_size != batch_size:
-            self.neural_net.set_batch_size(batch_size)
-        self.neural_net.n_train = X_train.shape[0]
+        if neural_net.batch_size != batch_size:
+            neural_net.set_batch_size(batch_size)
+        neural_net.n_train = X_train.shape[0]
         # standardize training data
-        self.neural_net.X = (X_train - self.feat_mean) / self.feat_std
-        self.neural_net.y = (y_train - self.output_mean) / self.output_std
+        neural_net.X = (X_train - self.feat_mean) / self.feat_std
+        neural_net.y = (y_train - self.output_mean) / self.output_std
 
         # train network for n_iter mini batches
-        self.neural_net.train(n_iter, store_loss=True, sequential=sequential, verbose=verbose)
+        neural_net.train(n_iter, store_loss=True, sequential=sequential, verbose=verbose,
+                         progress_bar=progress_bar)
+
+        # the squared error of the trained network, used as the new priorities
+        if compute_errors:
+            y_pred = neural_net.feed_forward(neural_net.X, batch_size=neural_net.n_train)
+            return np.mean((y_pred - neural_net.y.T)**2, axis=0)
+        return None
+
+    def _train_online_async(self, X_train, y_train, n_iter, batch_size, verbose,
+                            sequential, swap_interval, slots=None, insertions=None):
+        """
+        Asynchronous online training step. The shadow copy of the neural network
+        is trained on the latest online training data in a background thread, while
+        self.neural_net remains available for prediction. Every swap_interval steps,
+        the shadow and live copies are swapped, after waiting for the background
+        training to finish if required, and the shadow copy is trained on the latest
+        online data. The online data of the steps in between is not used.
+
+        Parameters
+        ----------
+        X_train : array
+            The (unstandardized) online features.
+        y_train : array
+            The (unstandardized) online target data.
+        n_iter : number of back propagation iterations
+        batch_size : Mini batch size.
+        verbose: print loss to screen during back propagation.
+        sequential: do not randomly sample the training data.
+        swap_interval: number of steps between two swaps.
+        slots: the replay buffer slots of the rows of X_train, used to update the priorities.
+               The priorities are updated in the calling thread once the background
+               training has finished.
+        insertions: the sample numbers of the slots at the time of sampling, see
+                    ReplayBuffer.update_priorities.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # create the shadow copy on the first asynchronous step
+        if getattr(self, 'shadow_net', None) is None:
+            self.shadow_net = copy.deepcopy(self.neural_net)
+            self.online_worker = None
+            self.n_online_steps = 0
+
+        if self.online_worker is not None:
+            self.n_online_steps += 1
+            # the shadow copy keeps training in the background until the next swap
+            if self.n_online_steps < swap_interval:
+                return
+            # wait for the shadow copy to finish training, and swap it with the live copy
+            self._join_online_worker()
+            self.swap_online_weights()
+            self.n_online_steps = 0
+
+        # train the shadow copy on the latest online data in the background, without
+        # a progress bar that would write to the console while predictions are made
+        self.online_priority_slots = (slots, insertions)
+        self.online_worker = threading.Thread(target=self._run_online_worker,
+                                              args=(self.shadow_net, X_train, y_train,
+                                                    n_iter, batch_size, verbose, sequential,
+                                                    slots is not None),
+                                              daemon=True)
+        self.online_worker.start()
+
+    def _run_online_worker(self, *args):
+        """
+        Target of the background online-training thread. The errors of the trained
+        shadow copy are stored, and only used in the calling thread after a join.
+        """
+        self.online_errors = self._train_online(*args, progress_bar=False)
+
+    def _join_online_worker(self):
+        """
+        Wait for the background online-training thread, and update the priorities of
+        the replay buffer slots it was trained on. The buffer is only modified in the
+        calling thread, and slots that were overwritten in the meantime are skipped.
+        """
+        self.online_worker.join()
+        slots, insertions = self.online_priority_slots
+        if slots is not None:
+            self.feat_eng.online_buffer.update_priorities(slots, self.online_errors,
+                                                          insertions=insertions)
+
+    def swap_online_weights(self):
+        """
+        Swap the live neural network with the shadow copy trained in the background,
+        and copy the new live weights to the shadow copy, such that the next
+        asynchronous training step continues from the latest weights.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.neural_net, self.shadow_net = self.shadow_net, self.neural_net
+
+        for layer_live, layer_shadow in zip(self.neural_net.layers[1:],
+                                            self.shadow_net.layers[1:]):
+            layer_shadow.W = layer_live.W.copy()
+            layer_shadow.V = layer_live.V.copy()
+            layer_shadow.A = layer_live.A.copy()
+
+    def finish_online_training(self):
+        """
+        Wait for the background online-training thread to finish, and make the
+        latest trained weights the live weights. Call this before storing the
+        surrogate if asynchronous online training was used.
+
+        Returns
+        -------
+        None.
+
+        """
+        if getattr(self, 'online_worker', None) is None:
+            return
+
+        self._join_online_worker()
+        self.swap_online_weights()
+        self.online_worker = None
+        self.shadow_net = None
 
     def generate_online_training_data(self, feats, LR_before, LR_after, HR_before, HR_after):
         """
@@ -225,7 +493,12 @@ class ANN_Surrogate(Campaign):
 
         self.feat_eng.generate_online_training_data(feats, LR_before, LR_after, HR_before, HR_after)
 
-    def set_online_training_parameters(self, tau_nudge, dt_LR, window_length):
+        # update the standardization statistics with the new sample
+        if getattr(self, 'feat_moments', None) is not None:
+            self.update_data_stats()
+
+    def set_online_training_parameters(self, tau_nudge, dt_LR, window_length,
+                                       running_stats=False, decay=None):
         """
         Stores parameters required for online training.
 
@@ -237,14 +510,40 @@ class ANN_Surrogate(Campaign):
             Time step low resolution model.
         window_length : int
             The length of the moving window in which online features are stored.
+        running_stats : boolean, optional
+            Update the mean and standard deviation of the features and target data
+            with every new online sample. The default is False.
+        decay : float, optional
+            If running_stats is True, use exponentially weighted moments where every
+            new sample gets weight decay. The default is None, in which case the
+            cumulative moments of the offline and online data are used.
 
         Returns
         -------
         None.
 
         """
+        assert getattr(self, 'output_pca', None) is None, \
+            "Online training is not supported for surrogates with output compression (pca_energy)"
+
         self.feat_eng.set_online_training_parameters(tau_nudge, dt_LR, window_length)
 
+        if running_stats:
+            assert hasattr(self.neural_net, 'X_mean') and hasattr(self.neural_net, 'y_mean'), \
+                "Running data statistics require standardize_X=True and standardize_y=True"
+            assert self.loss == 'squared', \
+                "Running data statistics are only supported for the squared loss"
+            assert self.neural_net.activation_out == 'linear', \
+                "Running data statistics are only supported for a linear output layer"
+            n_train = self.neural_net.X.shape[0]
+            self.feat_moments = es.methods.RunningMoments(self.feat_mean, self.feat_std,
+                                                          n=n_train, decay=decay)
+            self.output_moments = es.methods.RunningMoments(self.output_mean, self.output_std,
+                                                            n=n_train, decay=decay)
+        else:
+            self.feat_moments = None
+            self.output_moments = None
+
     def predict(self, feat):
         """
         Make a prediction f(feat). Here, f is given by ANN_Surrogate_feed_foward.
@@ -261,9 +560,13 @@ class ANN_Surrogate(Campaign):
 
         """
 
+        # reduce the features to the coordinates of the input projection
+        if getattr(self, 'projection', None) is not None:
+            feat = self.projection.transform(feat)
+
         # feat_eng._predict handles the preparation of the features and returns
         # self._feed_forward(X)
-        return self.feat_eng._predict(feat, self._feed_forward)
+        return self.feat_eng._predict(feat, self._feed_forward, vectorized=True)
 
     def _feed_forward(self, feat):
         """
@@ -272,13 +575,15 @@ class ANN_Surrogate(Campaign):
 
         Parameters
         ----------
-        feat : array of list of arrays
-               The feature array of a list of feature arrays on which to evaluate the surrogate.
+        feat : array
+               A single feature vector of shape (n_in,), or an array of shape
+               (n_samples, n_in) containing a feature vector per row.
 
         Returns
         -------
         y : array
-            the prediction of the neural net.
+            the prediction of the neural net, of shape (n_out,) for a single feature
+            vector and (n_samples, n_out) otherwise.
 
         """
 
@@ -286,12 +591,21 @@ class ANN_Surrogate(Campaign):
         feat = (feat - self.feat_mean) / self.feat_std
         if self.loss == 'cross_entropy':
             # y = the probability mass function at the output layer
-            y, _, _ = self.neural_net.get_softmax(feat.reshape([1, self.neural_net.n_in]))
-        else:
+            y, _, _ = self.neural_net.get_softmax(feat.reshape([-1, self.neural_net.n_in]))
+        elif feat.ndim == 1:
             # feed forward prediction step
-            y = self.neural_net.feed_forward(feat.reshape([1, self.neural_net.n_in])).flatten()
+            y = self.neural_net.predict_fast(feat.reshape([1, self.neural_net.n_in])).flatten()
             # transform y back to physical domain
             y = y * self.output_std + self.output_mean
+        else:
+            # feed forward all feature vectors at once
+            y = self.neural_net.predict_fast(feat).T
+            # transform y back to physical domain
+            y = y * self.output_std + self.output_mean
+
+        # reconstruct the full outputs from the principal component coefficients
+        if getattr(self, 'output_pca', None) is not None:
+            y = self.output_pca.inverse_transform(y)
 
         return y
 
@@ -299,6 +613,7 @@ class ANN_Surrogate(Campaign):
         """
         Save the state of the ANN surrogate to a pickle file
         """
+        self.finish_online_training()
         state = self.__dict__
         super().save_state(state=state, name=self.name)
 
@@ -331,6 +646,79 @@ class ANN_Surrogate(Campaign):
             self.output_mean = 0.0
             self.output_std = 1.0
 
+    def update_data_stats(self):
+        """
+        Update the running mean and standard deviation of the features and target with
+        the most recent online sample, and re-parameterize the weights of the first and
+        last layer such that the predictions in the physical domain do not change.
+
+        Returns
+        -------
+        None.
+
+        """
+        X_new, y_new = self.feat_eng.get_latest_online_training_data()
+        if X_new is None:
+            return
+
+        self.feat_moments.update(X_new)
+        self.output_moments.update(y_new)
+
+        self.reparameterize(self.feat_moments.mean, self.feat_moments.std,
+                            self.output_moments.mean, self.output_moments.std)
+
+    def reparameterize(self, feat_mean, feat_std, output_mean, output_std):
+        """
+        Change the standardization statistics of the features and target data, and
+        adapt the weights of the first and last layer accordingly. For the input, the
+        standardized feature (x - mu) / sigma enters the first layer via W and the bias
+        weights b, such that W' = W * sigma' / sigma and b' = b + W^T (mu' - mu) / sigma.
+        For the (linear) output, W' = W * sigma_y / sigma_y' and
+        b' = (b * sigma_y + mu_y - mu_y') / sigma_y'.
+
+        Parameters
+        ----------
+        feat_mean : array
+            The new mean of the features.
+        feat_std : array
+            The new standard deviation of the features.
+        output_mean : array
+            The new mean of the target data.
+        output_std : array
+            The new standard deviation of the target data.
+
+        Returns
+        -------
+        None.
+
+        """
+        # the output statistics can only be folded into a linear output layer
+        assert self.neural_net.activation_out == 'linear', \
+            "Reparameterization is only supported for a linear output layer"
+
+        n_in = self.neural_net.n_in
+        layer_1 = self.neural_net.layers[1]
+        layer_out = self.neural_net.layers[-1]
+
+        # the mean can only be shifted if the input layer has a bias neuron
+        if self.neural_net.layers[0].bias:
+            shift = (feat_mean - self.feat_mean) / self.feat_std
+            layer_1.W[n_in, :] += np.dot(shift, layer_1.W[0:n_in, :])
+        else:
+            feat_mean = self.feat_mean
+        layer_1.W[0:n_in, :] *= (feat_std / self.feat_std).reshape([-1, 1])
+
+        # the same for the linear output layer
+        layer_out.W *= (self.output_std / output_std).reshape([1, -1])
+        if self.neural_net.layers[-2].bias:
+            layer_out.W[-1, :] += (self.output_mean - output_mean) / output_std
+        else:
+            output_mean = self.output_mean
+
+        self.neural_net.X_mean, self.neural_net.X_std = feat_mean, feat_std
+        self.neural_net.y_mean, self.neural_net.y_std = output_mean, output_std
+        self.set_data_stats()
+
     def get_dimensions(self):
         """
         Get some useful dimensions of the ANN surrogate. Returns a dict with the number
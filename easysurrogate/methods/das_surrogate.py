@@ -37,7 +37,8 @@ class DAS_Surrogate(Campaign):
               n_layers=2, n_neurons=100,
               activation='tanh', activation_das='linear', loss='squared',
               batch_size=64, lamb=0.0,
-              standardize_X=True, standardize_y=True, **kwargs):
+              standardize_X=True, standardize_y=True, split=None, cache=None,
+              **kwargs):
         """
         Perform backpropagation to train the DAS network
 
@@ -73,6 +74,12 @@ class DAS_Surrogate(Campaign):
             Standardize the features. The default is True.
         standardize_y : Boolean, optional
             Standardize the output. The default is True.
+        split : DataSplit, optional
+            A precomputed train / test split, e.g. feat_eng.split of another surrogate
+            trained on the same data. The default is None.
+        cache : TrainingDataCache, optional
+            Cache in which the prepared training data is stored and looked up.
+            The default is None.
 
         Returns
         -------
@@ -91,7 +98,8 @@ class DAS_Surrogate(Campaign):
 
         # prepare the training data
         X_train, y_train, _, _ = self.feat_eng.get_training_data(
-            feats, target, test_frac=test_frac, train_first=True)
+            feats, target, test_frac=test_frac, train_first=True, split=split,
+            cache=cache)
 
         n_out = y_train.shape[1]
 
@@ -191,7 +199,7 @@ class DAS_Surrogate(Campaign):
             y, _, _ = self.neural_net.get_softmax(feat.reshape([1, self.neural_net.n_in]))
         else:
             # feed forward prediction step
-            y = self.neural_net.feed_forward(feat.reshape([1, self.neural_net.n_in])).flatten()
+            y = self.neural_net.predict_fast(feat.reshape([1, self.neural_net.n_in])).flatten()
             # transform y back to physical domain
             y = y * self.output_std + self.output_mean
 
@@ -257,3 +265,19 @@ class DAS_Surrogate(Campaign):
         dims['n_out'] = self.neural_net.n_out
 
         return dims
+
+    def get_projection(self):
+        """
+        Export the learned active subspace as an input-reduction stage, which can be
+        passed to the train subroutine of another surrogate (projection=...), e.g. to
+        train a GP on the d-dimensional active subspace coordinates.
+
+        Returns
+        -------
+        InputProjection
+            The projection onto the active subspace, W^T (x - feat_mean) / feat_std,
+            where W is the orthonormal weight matrix of the DAS layer.
+
+        """
+        W = self.neural_net.layers[1].W
+        return es.methods.InputProjection(W, self.feat_mean, self.feat_std)
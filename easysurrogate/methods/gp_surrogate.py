@@ -45,8 +45,9 @@ class GP_Surrogate(Campaign):
     ############################
 
     def train(self, feats, target, n_iter=0,
-              test_frac=0.0,
-              **kwargs):
+              test_frac=0.0, split=None, cache=None,
+              n_select=None, select_method='farthest', pca_energy=None,
+              projection=None, **kwargs):
         """
 
         Args:
@@ -54,6 +55,18 @@ class GP_Surrogate(Campaign):
             target: the target data
             n_iter: number of hyperoptimisation restarts
             test_frac: Fraction of the data used for training
+            split: precomputed train / test split (DataSplit), e.g. feat_eng.split of
+                another surrogate trained on the same data
+            cache: TrainingDataCache in which the prepared training data is stored and looked up
+            n_select: if specified, train on a representative subset of n_select samples,
+                the other samples are test samples. Ignores test_frac and split
+            select_method: the subset selection method, 'farthest', 'kmeans' or 'bins',
+                see Feature_Engineering.select_subset
+            pca_energy: if specified, the GP is trained on the coefficients of the leading
+                principal components of the target, which retain this fraction of the
+                variance (see PCACompression). predict reconstructs the full outputs
+            projection: InputProjection, e.g. obtained from DAS_Surrogate.get_projection.
+                If specified, the GP is trained on, and predicts with, the projected features
 
         Returns:
         -------
@@ -70,9 +83,31 @@ class GP_Surrogate(Campaign):
         else:
             self.noize = kwargs['noize']
 
+        # reduce the input features to the coordinates of the projection
+        self.projection = projection
+        if projection is not None:
+            feats = self._project(feats)
+            self.n_in = projection.d
+
+        # select a representative subset of the samples for training
+        if n_select is not None:
+            split = self.feat_eng.subset_split(feats, n_select, method=select_method)
+
         # prepare the training data
         X_train, y_train, X_test, y_test = self.feat_eng.get_training_data(
-            feats, target, local=False, test_frac=test_frac, train_first=False)
+            feats, target, local=False, test_frac=test_frac, train_first=False, split=split,
+            cache=cache)
+
+        # compress the target to the coefficients of its leading principal components
+        if pca_energy is not None:
+            self.output_pca = es.methods.PCACompression(energy=pca_energy)
+            self.output_pca.fit(y_train)
+            y_train = self.output_pca.transform(y_train)
+            if len(y_test) > 0:
+                y_test = self.output_pca.transform(y_test)
+            self.n_out = self.output_pca.n_components
+        else:
+            self.output_pca = None
 
         # scale the training data
         X_train = self.x_scaler.fit_transform(X_train)
@@ -119,20 +154,78 @@ class GP_Surrogate(Campaign):
         """
         # TODO slows down a lot, maybe FeatureEngineering should return training data still as list
         x = np.array([x for x in X]).T
+        if getattr(self, 'projection', None) is not None:
+            x = self.projection.transform(x.reshape([-1, self.projection.D]))
         x = self.x_scaler.transform(x)
         x = [np.array(i) for i in x.T.tolist()]
 
         # TODO unlike ANNs, GPs should provide API for vectorised .predict() and other methods
         y, std, _ = self.feat_eng._predict(x, feed_forward=lambda t: self.model.predict(t))
 
-        y = self.y_scaler.inverse_transform(y)
+        # sklearn returns a 1D mean for a single output
+        y = self.y_scaler.inverse_transform(y.reshape([-1, self.n_out]))
 
         self.y_scaler.with_mean = False
         std = self.y_scaler.inverse_transform(std * np.ones(y.shape))
         self.y_scaler.with_mean = True
 
+        # reconstruct the full outputs from the principal component coefficients
+        if getattr(self, 'output_pca', None) is not None:
+            std = np.sqrt(self.output_pca.inverse_variance(std**2))
+            y = self.output_pca.inverse_transform(y)
+
         return y, std
 
+    def _feed_forward(self, feat):
+        """
+        Predict the mean output of the GP for a batch of (projected) feature vectors.
+
+        Parameters
+        ----------
+        feat : array
+               A single feature vector of shape (n_in,), or an array of shape
+               (n_samples, n_in) containing a feature vector per row.
+
+        Returns
+        -------
+        y : array
+            the mean prediction, of shape (n_out,) for a single feature vector and
+            (n_samples, n_out) otherwise.
+
+        """
+        x = self.x_scaler.transform(np.asarray(feat).reshape([-1, self.n_in]))
+        y, _, _ = self.model.predict(x)
+        y = self.y_scaler.inverse_transform(np.asarray(y).reshape([-1, self.n_out]))
+
+        # reconstruct the full outputs from the principal component coefficients
+        if getattr(self, 'output_pca', None) is not None:
+            y = self.output_pca.inverse_transform(y)
+
+        if np.ndim(feat) == 1:
+            return y.flatten()
+        return y
+
+    def _project(self, feats):
+        """
+        Apply the input projection to the training features.
+
+        Parameters
+        ----------
+        feats : array or list of arrays
+            The feature arrays, each of shape (n_samples, n_points_i) or (n_samples,).
+
+        Returns
+        -------
+        array
+            The projected features, of shape (n_samples, d).
+
+        """
+        if not isinstance(feats, list):
+            feats = [feats]
+        n_samples = feats[0].shape[0]
+        X = np.concatenate([X_i.reshape([n_samples, -1]) for X_i in feats], axis=1)
+        return self.projection.transform(X)
+
     def save_state(self, state=None, **kwargs):
         """
         Save the state of GP surrogate as a pickle file
@@ -179,6 +272,9 @@ class GP_Surrogate(Campaign):
         feats: list of feature arrays
         target: array of target data
         n_iter: integer, number of iterations of sequential optimisation
+        n_new_cands: integer, optional, number of new samples added per iteration.
+            Samples are selected greedily, using the kriging believer for the
+            pending samples. The default is 1.
         """
 
         self.set_data_stats()
@@ -203,6 +299,12 @@ class GP_Surrogate(Campaign):
         if save_history:
             self.design_history = []
 
+        # the number of new samples per iteration, selected with the kriging believer
+        if 'n_new_cands' in kwargs:
+            n_new_cands = kwargs['n_new_cands']
+        else:
+            n_new_cands = 1
+
         if self.backend == 'scikit-learn':
 
             """
@@ -216,19 +318,21 @@ class GP_Surrogate(Campaign):
             for i in range(n_iter):
 
                 X_new, x_new_ind_test, x_new_ind_glob = self.feat_eng.\
-                    chose_feature_from_acquisition(acq_func_obj, self.X_test)
-                X_new = X_new.reshape(1, -1)
+                    chose_feature_from_acquisition(acq_func_obj, self.X_test,
+                                                   n_new_cands=n_new_cands, vectorized=True,
+                                                   believer=self.kriging_believer)
+                X_new = X_new.reshape(n_new_cands, -1)
 
                 # x_new_inds = feats.index(X_new)  # feats is list of features, for this
                 # has to be list of samples
-                y_new = self.y_test[x_new_ind_test].reshape(1, -1)
+                y_new = self.y_test[x_new_ind_test].reshape(n_new_cands, -1)
 
                 self.feat_eng.train_indices = np.concatenate([self.feat_eng.train_indices,
                                                               np.array(x_new_ind_glob).reshape(-1)])
                 self.feat_eng.test_indices = np.delete(
                     self.feat_eng.test_indices, x_new_ind_test, 0)
-                self.feat_eng.n_train += 1
-                self.feat_eng.n_test -= 1
+                self.feat_eng.n_train += n_new_cands
+                self.feat_eng.n_test -= n_new_cands
 
                 X_train = np.concatenate([self.X_train, X_new])
                 y_train = np.concatenate([self.y_train, y_new])
@@ -297,36 +401,60 @@ class GP_Surrogate(Campaign):
         """
         Returns the uncertainty of the model as (a posterior variance on Y) for a given sample
         Args:
-            sample: a single sample from a feature array
+            sample: a single sample from a feature array, or an array of samples of
+                shape (n_samples, n_in), which are evaluated with a single GP prediction
             candidates: list of input parameter files to chose optimum from
         Returns:
-            the value of uncertainty (variance) of the model
+            the value of uncertainty (variance) of the model, an array of n_samples values
+            for an array of samples. In the case of multiple outputs, the 2-norm of the
+            uncertainties of all outputs is used.
         """
 
-        if sample.ndim == 1:
-            sample = sample[None, :]
+        single = sample.ndim == 1
+        sample = sample.reshape([-1, self.model.n_in])
 
         _, uncertatinty, _ = self.model.predict(sample)
+        uncertatinty = np.linalg.norm(uncertatinty.reshape([sample.shape[0], -1]), axis=1)
 
+        if single:
+            return -1. * uncertatinty[0]
         return -1. * uncertatinty
 
     def poi_acquisition_function(self, sample, candidates=None):
         """
         Returns the probability of improvement for a given sample
         Args:
-            sample: a single sample from a feature array
+            sample: a single sample from a feature array, or an array of samples of
+                shape (n_samples, n_in), which are evaluated with a single GP prediction
             candidates: list of input parameter files to chose optimum from
         Returns:
-            the probability of improvement if a given sample will be added to the model
+            the probability of improvement if a given sample will be added to the model,
+            an array of n_samples values for an array of samples
         """
 
         jitter = 1e-9
         f_star = self.output_mean
 
-        if sample.ndim == 1:
-            sample = sample[None, :]
+        single = sample.ndim == 1
+        sample = sample.reshape([-1, self.model.n_in])
 
         mu, std, d = self.model.predict(sample)
-        poi = np.linalg.norm(np.divide(abs(mu - f_star), std + jitter), ord=2)
+        mu = mu.reshape([sample.shape[0], -1])
+        std = std.reshape([sample.shape[0], -1])
+        poi = np.linalg.norm(np.divide(abs(mu - f_star), std + jitter), ord=2, axis=1)
 
+        if single:
+            return -poi[0]
         return -poi
+
+    def kriging_believer(self, sample):
+        """
+        Condition the GP on a pending sample, using its predicted mean as the
+        observation. Used to select several new samples per iteration.
+        Args:
+            sample: a single sample from a feature array
+        Returns:
+            None
+        """
+        mu, _, _ = self.model.predict(sample)
+        self.model.condition(sample.reshape([1, -1]), mu.reshape([1, -1]))
@@ -34,7 +34,8 @@ class KMN_Surrogate(Campaign):
               test_frac=0.0,
               n_layers=2, n_neurons=100,
               activation='leaky_relu',
-              batch_size=64, lamb=0.0, **kwargs):
+              batch_size=64, lamb=0.0, split=None, cache=None, stencil=None,
+              dtype=None, sample_weights=None, **kwargs):
         """
         Perform back propagation to train the QSN
 
@@ -55,6 +56,23 @@ class KMN_Surrogate(Campaign):
         activation : Type of activation function. The default is 'leaky_relu'.
         batch_size : Mini batch size. The default is 64.
         lamb : L2 regularization parameter. The default is 0.0.
+        split : precomputed train / test split (DataSplit), e.g. feat_eng.split of
+                another surrogate trained on the same data. The default is None.
+        cache : TrainingDataCache object, in which the prepared training data is
+                stored and looked up. The default is None.
+        stencil : Stencil object. If specified, the input features of a local
+                  surrogate are the features at the neighbouring points given by
+                  the stencil offsets. The default is None.
+        dtype : storage data type of the training features, e.g. 'float32' or
+                'float16'. The features are standardized in place, such that a
+                single copy of the training features is stored. The default is
+                None, meaning the data type of feats.
+        sample_weights : If specified, the mini batches are drawn with importance
+                         sampling, and the loss is reweighted such that the gradient
+                         remains unbiased (see ImportanceSampler). 'density' for the
+                         inverse density of the binned target, 'loss' for the current
+                         loss value of every sample, or an array with a weight per
+                         training sample. The default is None, meaning uniform sampling.
 
         Returns
         -------
@@ -84,7 +102,11 @@ class KMN_Surrogate(Campaign):
                                                                  target,
                                                                  lags=lags,
                                                                  local=local,
-                                                                 test_frac=test_frac)
+                                                                 test_frac=test_frac,
+                                                                 split=split,
+                                                                 cache=cache,
+                                                                 stencil=stencil,
+                                                                 dtype=dtype)
 
         # get the maximum lag that was specified
         self.max_lag = self.feat_eng.max_lag
@@ -92,6 +114,11 @@ class KMN_Surrogate(Campaign):
         # number of output neurons
         n_out = self.n_bins * self.n_softmax
 
+        # weighted sampling of the mini batches
+        sampler = None
+        if sample_weights is not None:
+            sampler = self.feat_eng.importance_sampler(y_train, sample_weights)
+
         # create the feed-forward QSN
         self.neural_net = es.methods.ANN(X=X_train, y=y_train,
                                          n_layers=n_layers, n_neurons=n_neurons,
@@ -100,7 +127,7 @@ class KMN_Surrogate(Campaign):
                                          activation=activation, batch_size=batch_size,
                                          lamb=lamb, decay_step=10**4, decay_rate=0.9,
                                          standardize_X=True, standardize_y=False,
-                                         save=False,
+                                         copy_data=False, save=False,
                                          kernel_means=self.kernel_means,
                                          kernel_stds=self.kernel_stds)
 
@@ -108,7 +135,7 @@ class KMN_Surrogate(Campaign):
         print('Training Kernel Mixture Network...')
 
         # train network for N_iter mini batches
-        self.neural_net.train(n_iter, store_loss=True)
+        self.neural_net.train(n_iter, store_loss=True, sampler=sampler)
         self.set_data_stats()
         if lags is not None:
             self.feat_eng.initial_condition_feature_history(feats)
@@ -135,19 +162,24 @@ class KMN_Surrogate(Campaign):
         """
         # feat_eng._predict handles the preparation of the features and returns
         # self._feed_forward(X)
-        return self.feat_eng._predict(X, self._feed_forward)
+        return self.feat_eng._predict(X, self._feed_forward, vectorized=True)
 
     def _feed_forward(self, feat):
 
         feat = (feat - self.feat_mean) / self.feat_std
         # o_i = the probability mass function at the output layer
         # max_idx = the bin index with the highest probability
-        o_i, max_idx, _ = self.neural_net.get_softmax(feat.reshape([1, self.neural_net.n_in]))
+        o_i, max_idx, _ = self.neural_net.get_softmax(feat.reshape([-1, self.neural_net.n_in]))
         self.o_i = o_i
         self.max_idx = max_idx
+        # the selected kernels, one row per feature vector in the case of multiple vectors
+        idx = np.array(max_idx).T
         # return random sample from the conditional kernel density estimate
         # TODO: implement rvs from softmax layer
-        return norm.rvs(self.kernel_means_flat[max_idx], self.kernel_stds_flat[max_idx]).flatten()
+        y = norm.rvs(self.kernel_means_flat[idx], self.kernel_stds_flat[idx])
+        if feat.ndim == 1:
+            return y.flatten()
+        return y.reshape([feat.shape[0], -1])
 
     def save_state(self):
         """
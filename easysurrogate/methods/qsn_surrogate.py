@@ -32,7 +32,8 @@ class QSN_Surrogate(Campaign):
               n_layers=2, n_neurons=100,
               activation='leaky_relu',
               batch_size=64, lamb=0.0,
-              standardize_X = True, **kwargs):
+              standardize_X = True, split=None, cache=None, stencil=None, dtype=None,
+              sample_weights=None, **kwargs):
         """
         Perform back propagation to train the QSN
 
@@ -52,6 +53,23 @@ class QSN_Surrogate(Campaign):
         batch_size : Mini batch size. The default is 64.
         lamb : L2 regularization parameter. The default is 0.0.
         standardize_X : standardize the input features. Default is True.
+        split : precomputed train / test split (DataSplit), e.g. feat_eng.split of
+                another surrogate trained on the same data. The default is None.
+        cache : TrainingDataCache object, in which the prepared training data is
+                stored and looked up. The default is None.
+        stencil : Stencil object. If specified, the input features of a local
+                  surrogate are the features at the neighbouring points given by
+                  the stencil offsets. The default is None.
+        dtype : storage data type of the training features, e.g. 'float32' or
+                'float16'. The features are standardized in place, such that a
+                single copy of the training features is stored. The default is
+                None, meaning the data type of feats.
+        sample_weights : If specified, the mini batches are drawn with importance
+                         sampling, and the loss is reweighted such that the gradient
+                         remains unbiased (see ImportanceSampler). 'density' for the
+                         inverse density of the binned target, 'loss' for the current
+                         loss value of every sample, or an array with a weight per
+                         training sample. The default is None, meaning uniform sampling.
 
         Returns
         -------
@@ -76,7 +94,8 @@ class QSN_Surrogate(Campaign):
 
         # prepare the training data
         X_train, y_train, _, _ = self.feat_eng.get_training_data(
-            feats, target, lags=lags, local=local, test_frac=test_frac)
+            feats, target, lags=lags, local=local, test_frac=test_frac, split=split,
+            cache=cache, stencil=stencil, dtype=dtype)
 
         # get the maximum lag that was specified
         self.max_lag = self.feat_eng.max_lag
@@ -91,6 +110,11 @@ class QSN_Surrogate(Campaign):
         # falls in the 3rd bin
         one_hot_encoded_data = self.feat_eng.bin_data(y_train, n_bins)
 
+        # weighted sampling of the mini batches
+        sampler = None
+        if sample_weights is not None:
+            sampler = self.feat_eng.importance_sampler(y_train, sample_weights)
+
         # simple sampler to draw random samples from the bins
         self.sampler = es.methods.SimpleBin(self.feat_eng)
 
@@ -102,13 +126,13 @@ class QSN_Surrogate(Campaign):
                                          activation=activation, batch_size=batch_size,
                                          lamb=lamb, decay_step=10**4, decay_rate=0.9,
                                          standardize_X=standardize_X, standardize_y=False,
-                                         save=False)
+                                         copy_data=False, save=False)
 
         print('===============================')
         print('Training Quantized Softmax Network...')
 
         # train network for N_iter mini batches
-        self.neural_net.train(n_iter, store_loss=True)
+        self.neural_net.train(n_iter, store_loss=True, sampler=sampler)
         self.set_data_stats()
         if lags is not None:
             self.feat_eng.initial_condition_feature_history(feats)
@@ -130,7 +154,7 @@ class QSN_Surrogate(Campaign):
 
         """
 
-        return self.feat_eng._predict(X, self._feed_forward)
+        return self.feat_eng._predict(X, self._feed_forward, vectorized=True)
 
     def _feed_forward(self, feat):
         """
@@ -140,22 +164,26 @@ class QSN_Surrogate(Campaign):
 
         Parameters
         ----------
-        feat : array of list of arrays
-               The feature array of a list of feature arrays on which to evaluate the surrogate.
+        feat : array
+               A single feature vector of shape (n_in,), or an array of shape
+               (n_samples, n_in) containing a feature vector per row.
 
         Returns
         -------
         y : array
-            the stochastic prediction of the QSN.
+            the stochastic prediction of the QSN, of shape (n_softmax,) for a single
+            feature vector and (n_samples, n_softmax) otherwise.
         """
 
         # features were standardized during training, do so here as well
         feat = (feat - self.feat_mean) / self.feat_std
         # o_i = the probability mass function at the output layer
         # max_idx = the bin index with the highest probability
-        o_i, max_idx, _ = self.neural_net.get_softmax(feat.reshape([1, self.neural_net.n_in]))
+        o_i, max_idx, _ = self.neural_net.get_softmax(feat.reshape([-1, self.neural_net.n_in]))
         # resample a value from the selected bin
-        return self.sampler.resample(max_idx)
+        if feat.ndim == 1:
+            return self.sampler.resample(max_idx)
+        return self.sampler.resample(np.array(max_idx).T)
 
     def save_state(self):
         """
@@ -8,6 +8,7 @@ models by physical constraints, Computer & Fluids, 2020.
 ===============================================================================
 """
 
+from itertools import product
 import numpy as np
 import easysurrogate as es
 from ..campaign import Campaign
@@ -78,11 +79,15 @@ class Reduced_Surrogate(Campaign):
         return self.reduced_r(V_hat, dQ)
 
     def generate_online_training_data(self, feats, LR_before, LR_after, HR_before, HR_after,
-                                      qoi_func, nudge=False, **kwargs):
+                                      qoi_func, nudge=False, vectorized=False, **kwargs):
         """
         Compute the features and the target data for an online training step. Results are
         stored internally, and used within the 'train_online' subroutine.
 
+        If nudge or vectorized is True, all states are processed at once: the states are
+        stacked into reused arrays of shape (n_states, N, N), and the nudging correction
+        is computed in a single pass over the stacked states.
+
         Source:
         Rasp, "Coupled online learning as a way to tackle instabilities and biases
         in neural network parameterizations: general algorithms and Lorenz 96
@@ -105,6 +110,12 @@ class Reduced_Surrogate(Campaign):
             or HR state.
         nudge : boolean
             Nudge the HR state to the LR state. Default is False.
+        vectorized : boolean
+            If True, qoi_func is called once per resolution with all states stacked in
+            an array of shape (n_states, N, N), and must return the QoI of every state,
+            in an array of shape (n_states, n_qoi). The stacked array is reused in the
+            next call, and must not be stored by qoi_func. Default is False, meaning
+            qoi_func is called per state.
 
         Returns
         -------
@@ -127,49 +138,49 @@ class Reduced_Surrogate(Campaign):
         if isinstance(HR_after, np.ndarray):
             HR_after = [HR_after]
 
-        # store input features
-        for i in range(self.n_feat_arrays):
-            self.dQ_surr.feat_eng.online_feats[i].append(feats[i])
-
-        dQ = []
-        n_HR = HR_before[0].shape[0]
-        # loop over all states
-        for i in range(len(LR_before)):
-
-            if nudge:
-                # project the low-res model to the high-res grid
-                LR_before_projected = self.up_scale(LR_before[i], n_HR)
-
-                # the difference between the low res and high res model (projected to low-res grid)
-                # at time n
-                delta_nudge = LR_before_projected - HR_before[i]
-
-                # the estimated state of the (projected) HR model would there have been no nudging
-                HR_no_nudge = HR_after[i] - delta_nudge / self.tau_nudge * self.dt_LR
-
-                # compute the HR QoI
-                Q_HR = qoi_func(HR_no_nudge, **kwargs)
-
-                # compute the LR QoI
-                Q_LR = qoi_func(LR_after[i], **kwargs)
-
-            else:
-                # compute the HR QoI
-                Q_HR = qoi_func(HR_after[i], **kwargs)
-
-                # compute the LR QoI
-                Q_LR = qoi_func(LR_after[i], **kwargs)
-
-            dQ.append(Q_HR - Q_LR)
-
-        # The difference in HR and LR QoI is the target of the surrogate
-        self.dQ_surr.feat_eng.online_target.append(np.concatenate(dQ))
-
-        # remove oldest item from the online features is the window lendth is exceeded
-        if len(self.dQ_surr.feat_eng.online_feats[0]) > self.window_length:
-            for i in range(self.n_feat_arrays):
-                self.dQ_surr.feat_eng.online_feats[i].pop(0)
-            self.dQ_surr.feat_eng.online_target.pop(0)
+        HR, LR = HR_after, LR_after
+        if vectorized:
+            LR = self._stack_states('LR_after', LR_after)
+
+        if nudge:
+            # the HR states at the current time step, shape (n_states, N_HR, N_HR)
+            HR = self._stack_states('HR_after', HR_after)
+            n_HR = HR.shape[1]
+
+            # project the low-res model to the high-res grid
+            LR_before_projected = self._up_scale_stacked(
+                self._stack_states('LR_before', LR_before), n_HR)
+
+            # the difference between the low res and high res model (projected to
+            # low-res grid) at time n
+            delta_nudge = self._buffer('delta_nudge', HR.shape,
+                                       np.result_type(HR, LR_before_projected))
+            np.subtract(LR_before_projected, self._stack_states('HR_before', HR_before),
+                        out=delta_nudge)
+            delta_nudge *= self.dt_LR / self.tau_nudge
+
+            # the estimated state of the (projected) HR model would there have been
+            # no nudging, stored in the same array
+            HR = np.subtract(HR, delta_nudge, out=delta_nudge)
+            # qoi_func is passed fresh arrays if it is called per state
+            if not vectorized:
+                HR = np.array(HR)
+        elif vectorized:
+            HR = self._stack_states('HR_after', HR_after)
+
+        # compute the HR and LR QoI
+        if vectorized:
+            Q_HR = qoi_func(HR, **kwargs)
+            Q_LR = qoi_func(LR, **kwargs)
+        else:
+            Q_HR = [qoi_func(HR_i, **kwargs) for HR_i in HR]
+            Q_LR = [qoi_func(LR_i, **kwargs) for LR_i in LR]
+
+        dQ = np.subtract(Q_HR, Q_LR).flatten()
+
+        # The difference in HR and LR QoI is the target of the surrogate, store it
+        # together with the input features
+        self.dQ_surr.feat_eng.store_online_training_data(feats, dQ)
 
     def set_online_training_parameters(self, tau_nudge, dt_LR, window_length):
         """
@@ -236,7 +247,7 @@ class Reduced_Surrogate(Campaign):
 
         """
 
-        state = self.__dict__
+        state = {key: value for key, value in self.__dict__.items() if key != '_buffers'}
         super().save_state(state=state, name=self.name)
 
     def load_state(self):
@@ -436,6 +447,63 @@ class Reduced_Surrogate(Campaign):
         scaling_factor = (N_LR / N_HR)**d
         return X_hat * scaling_factor
 
+    def _buffer(self, name, shape, dtype):
+        """
+        Return a zero-initialized work array, which is allocated once and reused as long
+        as the shape and data type do not change.
+        """
+        # the buffers are not part of the stored state
+        buffers = self.__dict__.setdefault('_buffers', {})
+        buffer = buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.zeros(shape, dtype=dtype)
+            buffers[name] = buffer
+        return buffer
+
+    def _stack_states(self, name, states):
+        """
+        Stack a list of states of equal shape into a reused array of shape
+        (n_states, ...).
+        """
+        states = [np.asarray(state) for state in states]
+        dtype = np.result_type(*states)
+        return np.stack(states, out=self._buffer(name, (len(states),) + states[0].shape, dtype))
+
+    def _up_scale_stacked(self, X_hat, N_HR, out=None):
+        """
+        Up-scale a stack of 1D or 2D arrays of Fourier coefficients, of shape
+        (n_states, N_LR) or (n_states, N_LR, N_LR), see up_scale. The low-frequency
+        blocks are copied with the scaling factor applied into out, of which the
+        zero-padded high frequencies must be zero. If out is None, a reused array per
+        N_LR is used, such that its zero padding only has to be set once.
+        """
+
+        N_LR = X_hat.shape[1]
+        d = X_hat.ndim - 1
+
+        assert d == 1 or d == 2, "Upscaling only implemented for 1d or 2d arrays."
+
+        start = int(N_LR / 2)
+        pad_size = N_HR - N_LR
+        out_shape = (X_hat.shape[0],) + (N_HR,) * d
+        if out is None:
+            out = self._buffer(('up_scale', N_LR), out_shape, np.result_type(X_hat, 1j))
+        X_hat_HR = out
+
+        # In numpy only the inverse transform is scaled. The following term must be applied
+        # to ensure the correct scaling factor is applied in the inverse transform.
+        scaling_factor = (N_HR / N_LR)**d
+
+        # the (LR, HR) index ranges of the low and high halves of the spectrum
+        halves = [(slice(0, start), slice(0, start)),
+                  (slice(start, N_LR), slice(start + pad_size, N_HR))]
+        for block in product(halves, repeat=d):
+            lr = (slice(None),) + tuple(lr_i for lr_i, _ in block)
+            hr = (slice(None),) + tuple(hr_i for _, hr_i in block)
+            np.multiply(X_hat[lr], scaling_factor, out=X_hat_HR[hr])
+
+        return X_hat_HR
+
     def up_scale(self, X_hat, N_HR):
         """
         Up-scale X to a higher spatial resolution by padding high-frequency Fourier coefficients with
@@ -456,25 +524,10 @@ class Reduced_Surrogate(Campaign):
 
         """
 
-        N_LR = X_hat.shape[0]
-        d = X_hat.ndim
-
-        # assert N_LR < N_HR, "X_hat.shape[0] must be < N_HR in order to upscale X_hat."
-        assert d == 1 or d == 2, "Upscaling only implemented for 1d or 2d arrays."
-
-        start = int(N_LR / 2)
-        pad_size = N_HR - N_LR
-        if X_hat.ndim == 1:
-            # pad the 1d array with zeros
-            X_hat = np.insert(X_hat, start, np.zeros(pad_size) + 0j)
-        elif X_hat.ndim == 2:
-            # pad the 2d array with a 'cross' of zeros
-            X_hat = np.insert(X_hat, start, np.zeros([pad_size, N_LR]) + 0j, axis=0)
-            X_hat = np.insert(X_hat, start, np.zeros([pad_size, N_HR]) + 0j, axis=1)
-        # In numpy only the inverse transform is scaled. The following term must be applied
-        # to ensure the correct scaling factor is applied in the inverse transform.
-        scaling_factor = (N_HR / N_LR)**d
-        return X_hat * scaling_factor
+        X_hat = np.asarray(X_hat)[np.newaxis]
+        # pad the 1d array with zeros, or the 2d array with a 'cross' of zeros
+        X_hat_HR = np.zeros((1,) + (N_HR,) * (X_hat.ndim - 1), dtype=np.result_type(X_hat, 1j))
+        return self._up_scale_stacked(X_hat, N_HR, out=X_hat_HR)[0]
 
 
 def compute_int(X1_hat, X2_hat, N):